@@ -0,0 +1,7 @@
+"""
+Benchmarks for INCH
+
+Each module can be run on its own, e.g. `python -m benchmarks.read_vcf`.
+benchmarks.suite runs the hot paths on synthetic data from benchmarks.synth
+and compares them with stored baselines.
+"""
@@ -0,0 +1,73 @@
+"""
+Compare parsing a VCF with scikit-allel's defaults against INCH's field list
+
+Writes a synthetic gzipped VCF (with the QUAL, FILTER, ID and INFO columns real
+pipelines produce) and reports parse time and peak traced memory for both.
+"""
+
+# command-line argument handling
+import argparse
+import os
+import tempfile
+# timing and memory measurement
+import time
+import tracemalloc
+import allel
+import numpy as np
+from inch import myutils
+from benchmarks import synth
+
+def measure(func) -> tuple[float, int]:
+    """
+    Time a function and trace its peak memory allocation
+
+    Parameters
+    ----------
+    func : Callable[[], Any]
+        Function to run
+    
+    Returns
+	-------
+	seconds : float
+        Wall time taken
+    peak : int
+        Peak bytes allocated while running
+    """
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmark VCF parsing with and without field selection')
+    parser.add_argument('--sites', type = int, default = 100000)
+    parser.add_argument('--samples', type = int, default = 100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vcf = os.path.join(tmp, 'bench.vcf.gz')
+        rng = np.random.default_rng(0)
+        alleles = synth.random_sites(rng, args.sites, 0)
+        synth.write_vcf(vcf, ['Y'], alleles,
+                        synth.random_calls(rng, alleles, args.samples), 'S',
+                        0.05, rng, annotated = True)
+        runs = {
+            'default fields' : lambda: allel.read_vcf(vcf),
+            'INCH fields' : lambda: allel.read_vcf(
+                vcf, fields = myutils.VCF_FIELDS, types = myutils.VCF_TYPES,
+                alt_number = myutils.ALT_NUMBER)
+        }
+        print('{sites} sites x {samples} samples'.format(
+            sites = args.sites, samples = args.samples))
+        for name, run in runs.items():
+            seconds, peak = measure(run)
+            print('{name:>16}: {seconds:.2f} s, peak {mb:.1f} MB'.format(
+                name = name, seconds = seconds, mb = peak / 2 ** 20))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Time and trace memory of INCH's hot paths at several scales
+
+Runs each benchmark on synthetic VCFs (see benchmarks.synth) and compares the
+results with stored baselines, so that a change which slows any of them down
+stands out. Baselines depend on the machine: save new ones with --save before
+comparing changes on a different computer.
+"""
+
+# command-line argument handling
+import argparse
+import json
+import os
+import sys
+import tempfile
+# timing and memory measurement
+import time
+import tracemalloc
+import warnings
+from inch import myutils
+from benchmarks import synth
+
+# sizes of synthetic data: positions, founders and descendents
+SCALES = {'small' : (2000, 20, 50),
+          'medium' : (20000, 50, 200),
+          'large' : (100000, 100, 1000)}
+# the pairwise engine calls Python for every pair, so it only runs when small
+PAIRWISE_SCALES = ['small']
+# founders in each group for the group merging benchmark
+GROUP_SIZE = 5
+# measurements below these floors are noise, so compare as if at the floor
+FLOORS = {'seconds' : 0.01, 'peak_mb' : 1}
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+def benchmarks(founders: str, descendents: str, scale: str) -> dict:
+    """
+    List the benchmarks to run on a pair of VCFs
+
+    Parameters
+    ----------
+    founders : str
+        Founders VCF
+    descendents : str
+        Descendents VCF
+    scale : str
+        Which of SCALES the VCFs are
+
+    Returns
+	-------
+	runs : dict[str, Callable[[], Any]]
+        Each benchmark's name pointing to a function running it
+    """
+
+    # inputs for the steps after parsing are made once, outside the timing
+    founder_geno = myutils._get_geno(founders, 'Y')[0]
+    desc_geno = myutils._get_geno(descendents, 'Y')[0]
+    matrix = myutils._geno_dists(founder_geno, founder_geno)
+    ids = list(matrix.index)
+    groups = [ids[i:i + GROUP_SIZE] for i in range(0, len(ids), GROUP_SIZE)]
+
+    runs = {'get_geno' : lambda: myutils._get_geno(founders, 'Y')}
+    for engine in myutils.DIST_ENGINES:
+        if engine == 'pairwise' and scale not in PAIRWISE_SCALES: continue
+        runs['geno_dists[{engine}]'.format(engine = engine)] = \
+            lambda engine = engine: myutils._geno_dists(desc_geno,
+                                                        founder_geno, engine)
+    runs['merge_matrix_groups'] = \
+        lambda: myutils._merge_matrix_groups(matrix, groups)
+    runs['identify_founders'] = \
+        lambda: myutils.identify_founders(founders, descendents, 'Y', None,
+                                          None)
+    for solver in ['auto', 'incremental']:
+        runs['pca[{solver}]'.format(solver = solver)] = \
+            lambda solver = solver: myutils.pca(descendents, 'Y', 2, solver)
+    return runs
+
+def measure(func, repeat: int = 3) -> dict:
+    """
+    Time a function, then run it once more to trace its peak memory
+
+    Parameters
+    ----------
+    func : Callable[[], Any]
+        Function to run
+    repeat : int
+        How many timed runs to take the fastest of. Default 3.
+
+    Returns
+	-------
+	result : dict
+        Fastest wall time ('seconds') and peak traced allocation ('peak_mb')
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    # tracing slows code down, so it is kept apart from the timed runs
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds' : round(min(times), 4),
+            'peak_mb' : round(peak / 2 ** 20, 2)}
+
+def compare(results: dict, baselines: dict, tolerance: float) -> list[str]:
+    """
+    Print results next to baselines, listing those which got worse
+
+    Parameters
+    ----------
+    results : dict
+        Scale, then benchmark, then measure() output
+    baselines : dict
+        The same for stored baselines
+    tolerance : float
+        How many times the baseline a measurement may be before it counts
+        as a regression
+
+    Returns
+	-------
+	regressions : list[str]
+        Descriptions of each measurement worse than tolerance allows
+    """
+
+    regressions = []
+    for scale, runs in results.items():
+        print('{scale}: {sites} sites, {founders} founders, {desc} '
+              'descendents'.format(scale = scale, sites = SCALES[scale][0],
+                                   founders = SCALES[scale][1],
+                                   desc = SCALES[scale][2]))
+        for name, result in runs.items():
+            base = baselines.get(scale, {}).get(name)
+            line = '  {name:>24}: {seconds:8.3f} s {mb:9.1f} MB'.format(
+                name = name, seconds = result['seconds'],
+                mb = result['peak_mb'])
+            if base is not None:
+                ratios = {key : max(result[key], floor) /
+                                max(base[key], floor)
+                          for key, floor in FLOORS.items()}
+                line += '  ({seconds:.2f}x time, {mb:.2f}x memory)'.format(
+                    seconds = ratios['seconds'], mb = ratios['peak_mb'])
+                for key, ratio in ratios.items():
+                    if ratio > tolerance:
+                        regressions.append('{scale} {name} {key}: {ratio:.2f}x'
+                                           .format(scale = scale, name = name,
+                                                   key = key, ratio = ratio))
+            print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmark INCH hot paths against stored baselines')
+    parser.add_argument('--scales', nargs = '+', choices = list(SCALES),
+                        default = ['small', 'medium'])
+    parser.add_argument('--only', nargs = '+', metavar = 'BENCHMARK',
+                        help = 'Only run benchmarks with these names')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--tolerance', type = float, default = 1.5,
+                        help = 'Ratio to baseline counted as a regression')
+    parser.add_argument('--baselines', default = BASELINES)
+    parser.add_argument('--save', action = 'store_true',
+                        help = 'Store these results as the new baselines')
+    args = parser.parse_args()
+    # synthetic VCFs are not tabix-indexed, which allel warns about every read
+    warnings.filterwarnings('ignore', 'tabix not found')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            founders, descendents = synth.write_panel(tmp, *SCALES[scale])
+            runs = benchmarks(founders, descendents, scale)
+            results[scale] = {name : measure(run, args.repeat)
+                              for name, run in runs.items()
+                              if args.only is None or name in args.only}
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f: baselines = json.load(f)
+    regressions = compare(results, baselines, args.tolerance)
+    if args.save:
+        for scale, runs in results.items():
+            baselines.setdefault(scale, {}).update(runs)
+        with open(args.baselines, 'w') as out:
+            json.dump(baselines, out, indent = 2, sort_keys = True)
+            out.write('\n')
+    if regressions:
+        print('Slower or larger than baseline:\n  ' + '\n  '.join(regressions))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
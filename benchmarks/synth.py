@@ -0,0 +1,194 @@
+"""
+Deterministic synthetic VCFs for benchmarks
+
+Descendents are copies of random founders with a few changed calls, so that
+assignment has a right answer. Run as `python -m benchmarks.synth DIR` to write
+a pair of VCFs for use elsewhere.
+"""
+
+# command-line argument handling
+import argparse
+# compressed VCF output
+import gzip
+import os
+import numpy as np
+from inch import myutils
+
+def write_panel(directory: str, n_sites: int, n_founders: int, n_desc: int,
+                missing: float = 0.05, multiallelic: float = 0.05,
+                chroms: list[str] = None, error: float = 0.01,
+                seed: int = 0) -> tuple[str, str]:
+    """
+    Write gzipped founder and descendent VCFs
+
+    Parameters
+    ----------
+    directory : str
+        Directory to write founders.vcf.gz and descendents.vcf.gz to
+    n_sites : int
+        Number of positions on each chromosome
+    n_founders : int
+        Number of founders
+    n_desc : int
+        Number of descendents
+    missing : float
+        Fraction of calls which are missing. Default 0.05.
+    multiallelic : float
+        Fraction of positions with two or three ALT alleles. Default 0.05.
+    chroms : list[str]
+        Chromosome names. Default ['Y'].
+    error : float
+        Fraction of a descendent's calls differing from its founder's.
+        Default 0.01.
+    seed : int
+        Random seed. Default 0.
+
+    Returns
+	-------
+	founders : str
+        Filename of the founders VCF
+    descendents : str
+        Filename of the descendents VCF
+    """
+
+    if chroms is None: chroms = ['Y']
+    rng = np.random.default_rng(seed)
+    alleles = random_sites(rng, n_sites * len(chroms), multiallelic)
+    founders = random_calls(rng, alleles, n_founders)
+    # descendents copy a founder, then some calls change
+    desc = founders[:, rng.integers(0, n_founders, n_desc)]
+    changed = rng.random(desc.shape) < error
+    desc = np.where(changed, random_calls(rng, alleles, n_desc), desc)
+
+    files = [os.path.join(directory, name + '.vcf.gz')
+             for name in ['founders', 'descendents']]
+    for file, calls, prefix in zip(files, [founders, desc], ['F', 'D']):
+        write_vcf(file, chroms, alleles, calls, prefix, missing, rng)
+    return tuple(files)
+
+def random_sites(rng: np.random.Generator, n_rows: int,
+                 multiallelic: float) -> list[np.ndarray]:
+    """
+    Pick REF and ALT alleles for each position
+
+    Parameters
+    ----------
+    rng : np.random.Generator
+        Random number source
+    n_rows : int
+        Number of positions
+    multiallelic : float
+        Fraction of positions with two or three ALT alleles
+
+    Returns
+	-------
+	alleles : list[np.ndarray]
+        Distinct bases at each position, REF first
+    """
+
+    bases = np.array(list(myutils.BASES))
+    n_alts = np.where(rng.random(n_rows) < multiallelic,
+                      rng.integers(2, 4, n_rows), 1)
+    return [rng.permutation(bases)[:n + 1] for n in n_alts]
+
+def random_calls(rng: np.random.Generator, alleles: list[np.ndarray],
+                 n_samples: int) -> np.ndarray:
+    """
+    Pick a random allele for each sample at each position
+
+    Parameters
+    ----------
+    rng : np.random.Generator
+        Random number source
+    alleles : list[np.ndarray]
+        Alleles at each position, as from random_sites
+    n_samples : int
+        Number of samples
+
+    Returns
+	-------
+	calls : np.ndarray
+        k positions x n samples array of allele numbers (0 is REF)
+    """
+
+    n_alleles = np.array([len(site) for site in alleles])
+    return rng.integers(0, n_alleles[:, None], (len(alleles), n_samples))
+
+def write_vcf(file: str, chroms: list[str], alleles: list[np.ndarray],
+              calls: np.ndarray, prefix: str, missing: float,
+              rng: np.random.Generator, annotated: bool = False) -> None:
+    """
+    Write haploid genotype calls as a gzipped VCF
+
+    Parameters
+    ----------
+    file : str
+        Filename to write
+    chroms : list[str]
+        Chromosome names; positions are split evenly between them, in order
+    alleles : list[np.ndarray]
+        Alleles at each position, as from random_sites
+    calls : np.ndarray
+        k positions x n samples array of allele numbers
+    prefix : str
+        Sample IDs are this followed by a number from 1
+    missing : float
+        Fraction of calls written as missing
+    rng : np.random.Generator
+        Random number source
+    annotated : bool
+        Whether to fill the ID, QUAL and INFO columns (and their header
+        lines), as real pipelines do. Default False.
+    """
+
+    n_sites = len(alleles) // len(chroms)
+    calls = calls.astype(str)
+    calls[rng.random(calls.shape) < missing] = '.'
+    with gzip.open(file, 'wt') as out:
+        out.write('##fileformat=VCFv4.3\n')
+        if annotated:
+            out.write('##INFO=<ID=AF,Number=A,Type=Float,Description="AF">\n')
+            out.write('##INFO=<ID=DP,Number=1,Type=Integer,'
+                      'Description="Depth">\n')
+            out.write('##FILTER=<ID=s50,Description="Half missing">\n')
+        out.write('##FORMAT=<ID=GT,Number=1,Type=String,'
+                  'Description="Genotype">\n')
+        out.write('#' + '\t'.join(
+            ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO',
+             'FORMAT'] +
+            [prefix + str(i + 1) for i in range(calls.shape[1])]) + '\n')
+        for row, site in enumerate(alleles):
+            pos = row % n_sites + 1
+            id, qual, info = '.', '.', '.'
+            if annotated:
+                id = 'rs' + str(pos)
+                qual = rng.integers(20, 60)
+                info = 'AF=0.35;DP={dp}'.format(dp = rng.integers(10, 100))
+            out.write('{chr}\t{pos}\t{id}\t{ref}\t{alt}\t{qual}\tPASS\t{info}'
+                      '\tGT\t'.format(chr = chroms[row // n_sites], pos = pos,
+                                      id = id, ref = site[0],
+                                      alt = ','.join(site[1:]), qual = qual,
+                                      info = info))
+            out.write('\t'.join(calls[row]) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Write synthetic founder and descendent VCFs')
+    parser.add_argument('directory')
+    parser.add_argument('--sites', type = int, default = 10000)
+    parser.add_argument('--founders', type = int, default = 20)
+    parser.add_argument('--descendents', type = int, default = 100)
+    parser.add_argument('--missing', type = float, default = 0.05)
+    parser.add_argument('--multiallelic', type = float, default = 0.05)
+    parser.add_argument('--chroms', nargs = '+', default = ['Y'])
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok = True)
+    for file in write_panel(args.directory, args.sites, args.founders,
+                            args.descendents, args.missing, args.multiallelic,
+                            args.chroms, seed = args.seed):
+        print(file)
+
+if __name__ == '__main__':
+    main()
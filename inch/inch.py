@@ -7,15 +7,185 @@ Command-line script to categorize samples one of a set of given haplotypes
 # command-line argument handling
 import argparse
 # helpers from elsewhere in the module
-from inch import myutils, __version__
+from inch import myutils, tabix, __version__
 # basic utilities
 from os import path
 import sys
 
+def index(argv):
+	"""
+	Pre-encode a VCF's genotypes so later runs can skip parsing it
+	"""
+
+	parser = argparse.ArgumentParser(
+		prog = 'inch index',
+		description = 'Save encoded genotypes next to a VCF for faster reuse'
+	)
+	parser.add_argument('vcf', help = 'VCF to index', metavar = 'VCF')
+	parser.add_argument('-c', '--chr', help = 'Chromosome to filter from VCF', 
+		     metavar = 'CHR')
+	args = parser.parse_args(argv)
+
+	if not path.exists(args.vcf):
+		myutils.ERROR('{vcf} does not exist'.format(vcf = args.vcf))
+	print(myutils.index_vcf(args.vcf, args.chr))
+	sys.exit(0)
+
+def batch(argv):
+	"""
+	Identify founders for many descendent VCFs, reading founders only once
+	"""
+
+	parser = argparse.ArgumentParser(
+		prog = 'inch batch',
+		description = 'Match descendents in many VCFs to one set of founders'
+	)
+	parser.add_argument('founders', help = 'VCF with founder genotypes', 
+		     metavar = 'FOUNDER-VCF')
+	parser.add_argument('descendents', help = 'VCFs with descendent genotypes',
+		     metavar = 'DESCENDENT-VCF', nargs = '*')
+	parser.add_argument('--manifest', metavar = 'FILE',
+		     help = 'File listing more descendent VCFs, one per line')
+	parser.add_argument('-c', '--chr', help = 'Chromosome to filter from VCF', 
+		     metavar = 'CHR')
+	parser.add_argument('-g', '--groups', help = 'Founder groups', 
+		     metavar = 'GROUP', nargs = '+')
+	parser.add_argument('--chunk-size', 
+		     help = 'Stream descendents from their VCF NUM positions at a time',
+		     metavar = 'NUM', type = int)
+	parser.add_argument('-j', '--jobs', 
+		     help = 'Number of descendent VCFs to process at once. Default: 1',
+		     metavar = 'NUM', type = int, default = 1)
+	parser.add_argument('-t', '--threads', 
+		     help = 'Number of threads for each job. Default: 1',
+		     metavar = 'NUM', type = int, default = 1)
+	parser.add_argument('-o', '--out', metavar = 'FILE',
+		     help = 'Write combined output to file. Default: stdout')
+	parser.add_argument('--out-dir', metavar = 'DIR',
+		     help = 'Write one output file per descendent VCF to this directory')
+	args = parser.parse_args(argv)
+
+	descendents = list(args.descendents)
+	if args.manifest is not None:
+		if not path.exists(args.manifest):
+			myutils.ERROR('{manifest} does not exist'.format(
+				manifest = args.manifest))
+		with open(args.manifest) as f:
+			descendents += [line.strip() for line in f if line.strip()]
+	if not descendents:
+		myutils.ERROR('Please give at least one descendent VCF')
+	for file in [args.founders] + descendents:
+		if not path.exists(file):
+			myutils.ERROR('{file} does not exist'.format(file = file))
+	for option, value in [('--jobs', args.jobs), ('--threads', args.threads),
+			   ('--chunk-size', args.chunk_size)]:
+		if value is not None and value <= 0:
+			myutils.ERROR('{option} must be positive'.format(option = option))
+	if args.out is not None and args.out_dir is not None:
+		myutils.ERROR('Please specify at most one of -o and --out-dir')
+	if args.out_dir is not None and not path.isdir(args.out_dir):
+		myutils.ERROR('{dir} is not a directory'.format(dir = args.out_dir))
+	if args.out is not None and not path.exists(path.dirname(args.out)):
+		myutils.ERROR('Directory for {out} does not exist'.format(out = args.out))
+	# per-file outputs are named after their VCFs, so names must not clash
+	names = [_batch_name(file) for file in descendents]
+	if args.out_dir is not None and len(set(names)) != len(names):
+		myutils.ERROR('Some descendent VCFs have the same name')
+
+	# loaded only now, so that bad arguments are reported quickly
+	import pandas as pd
+	outf = None
+	if args.out_dir is None:
+		outf = sys.stdout if args.out is None else open(args.out, 'w')
+	results = myutils.identify_batch(args.founders, descendents, args.chr,
+		args.groups, args.jobs, chunk_size = args.chunk_size, 
+		threads = args.threads)
+	for name, (file, matches) in zip(names, results):
+		if outf is None:
+			myutils.print_df(matches, path.join(args.out_dir, name + '.tsv'),
+				round = False, header = False)
+		else:
+			# combined output starts each line with the descendent VCF
+			matches.index = pd.MultiIndex.from_product([[file], matches.index])
+			myutils.print_df(matches, outf, round = False, header = False)
+	if outf is not None: outf.close()
+	sys.exit(0)
+
+def _batch_name(file):
+	"""
+	Name a descendent VCF's output after it, without its VCF extensions
+	"""
+
+	name = path.basename(file)
+	for extension in ['.gz', '.bgz', '.vcf']:
+		if name.endswith(extension): name = name[:-len(extension)]
+	return name
+
+def serve(argv):
+	"""
+	Keep founders loaded and match descendent VCFs sent over a socket
+	"""
+
+	parser = argparse.ArgumentParser(
+		prog = 'inch serve',
+		description = 'Answer requests to match descendents to founders',
+		epilog = 'Send one JSON request per line: {"vcf": PATH} or ' \
+			'{"text": VCF}. Each is answered with {"matches": {ID: FOUNDER}} ' \
+			'or {"error": MESSAGE}.'
+	)
+	parser.add_argument('founders', help = 'VCF with founder genotypes', 
+		     metavar = 'FOUNDER-VCF')
+	parser.add_argument('-c', '--chr', help = 'Chromosome to filter from VCF', 
+		     metavar = 'CHR')
+	parser.add_argument('-g', '--groups', help = 'Founder groups', 
+		     metavar = 'GROUP', nargs = '+')
+	parser.add_argument('--socket', help = 'Unix socket to listen on', 
+		     metavar = 'PATH')
+	parser.add_argument('--port', help = 'Local TCP port to listen on', 
+		     metavar = 'PORT', type = int)
+	parser.add_argument('--host', 
+		     help = 'Address to listen on with --port. Default: 127.0.0.1',
+		     metavar = 'HOST', default = '127.0.0.1')
+	parser.add_argument('--chunk-size', 
+		     help = 'Stream descendents from their VCF NUM positions at a time',
+		     metavar = 'NUM', type = int)
+	parser.add_argument('-j', '--jobs', 
+		     help = 'Number of requests to process at once. Default: 1',
+		     metavar = 'NUM', type = int, default = 1)
+	parser.add_argument('-t', '--threads', 
+		     help = 'Number of threads for each job. Default: 1',
+		     metavar = 'NUM', type = int, default = 1)
+	args = parser.parse_args(argv)
+
+	if (args.socket is None) == (args.port is None):
+		myutils.ERROR('Please specify exactly one of --socket and --port')
+	if args.socket is not None and path.exists(args.socket):
+		myutils.ERROR('{socket} already exists'.format(socket = args.socket))
+	if not path.exists(args.founders):
+		myutils.ERROR('{founders} does not exist'.format(founders = args.founders))
+	for option, value in [('--jobs', args.jobs), ('--threads', args.threads),
+			   ('--chunk-size', args.chunk_size)]:
+		if value is not None and value <= 0:
+			myutils.ERROR('{option} must be positive'.format(option = option))
+	# the server and its event loop are only needed here
+	from inch import serve as server
+	server.serve(args.founders, args.chr, args.groups, args.socket, args.host,
+		args.port, args.jobs, args.chunk_size, args.threads)
+	sys.exit(0)
+
+# subcommands, which are given the rest of the command line to parse
+SUBCOMMANDS = {'index' : index, 'batch' : batch, 'serve' : serve}
+
 def main():
+	if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+		SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
 	parser = argparse.ArgumentParser(
 		prog = 'inch',
-		description = 'Command-line script to categorize samples as a haplotype'
+		description = 'Command-line script to categorize samples as a haplotype',
+		epilog = 'Run "inch index VCF" to pre-encode a VCF for faster reuse, ' \
+			'"inch batch" to match many descendent VCFs at once, or "inch serve" ' \
+			'to keep founders loaded between requests.'
 	)
 
 	# input
@@ -23,17 +193,47 @@ def main():
 		     metavar = 'FOUNDER-VCF')
 
 	# extra analysis options
-	parser.add_argument('-c', '--chr', help = 'Chromosome to filter from VCF', 
-		     metavar = 'CHR')
+	parser.add_argument('-c', '--chr', 
+		     help = 'Chromosome to filter from VCF; repeat to analyse several ' \
+			 'separately', metavar = 'CHR', action = 'append')
+	parser.add_argument('--all-chroms', action = 'store_true',
+		     help = 'Analyse each chromosome in the VCF separately')
+	parser.add_argument('--region', help = 'Region to filter from VCF', 
+		     metavar = 'CHR:START-END')
+	parser.add_argument('--founder-samples', metavar = 'FILE',
+		     help = 'Only use the founders listed in FILE, one ID per line')
+	parser.add_argument('--samples', metavar = 'FILE',
+		     help = 'Only use the descendents (or --project samples) listed ' \
+			 'in FILE, one ID per line')
 	parser.add_argument('-g', '--groups', help = 'Founder groups', 
 		     metavar = 'GROUP', nargs = '+')
 	parser.add_argument('--dump-matrix', 
 		     help = 'Write intermediate founders-descendents distance matrix',
 		     metavar = 'FILE')
+	parser.add_argument('--group-dists', 
+		     help = 'Write distance from each descendent to each founder group',
+		     metavar = 'FILE')
+	parser.add_argument('--top-k', 
+		     help = 'Report the K nearest founders to each descendent',
+		     metavar = 'K', type = int)
+	parser.add_argument('--chunk-size', 
+		     help = 'Stream descendents from their VCF NUM positions at a time',
+		     metavar = 'NUM', type = int)
+	parser.add_argument('--store', metavar = 'FILE',
+		     help = 'Reuse and keep -d matches in a SQLite file, so unchanged ' \
+			 'descendents are not matched again')
+	parser.add_argument('-t', '--threads', 
+		     help = 'Number of threads for distance calculations. Default: 1',
+		     metavar = 'NUM', type = int, default = 1)
 
 	# what analysis type to run
 	parser.add_argument('-p', '--pca', help = 'Run PCA on founders', 
 		     metavar = 'NUM', type = int)
+	parser.add_argument('--pca-solver', choices = myutils.PCA_SOLVERS,
+		     help = 'How to run PCA. Default: auto', 
+		     default = myutils.PCA_SOLVERS[0])
+	parser.add_argument('--project', metavar = 'VCF',
+		     help = 'Place samples from another VCF on the founders\' PCs')
 	parser.add_argument('-m', '--matrix',
 		     help = 'Calculate distance matrix for founders',
 			 action = 'store_true')
@@ -43,6 +243,13 @@ def main():
 	# output
 	parser.add_argument('-o', '--out',
 		     help = 'Write output to file. Default: stdout', metavar = 'FILE')
+	parser.add_argument('--combined', metavar = 'FILE',
+		     help = 'With -d on several chromosomes, write all matches to one table')
+	parser.add_argument('--format', choices = list(myutils.OUT_FORMATS),
+		     help = 'Format for -m output and --dump-matrix. Default: guessed ' \
+			 'from the file extension, else tsv')
+	parser.add_argument('--profile', metavar = 'FILE',
+		     help = 'Write time and memory taken by each stage as JSON')
 	
 	parser.add_argument('--version', help = 'Print the version and quit',
 		action='version', version = '{version}'.format(version=__version__))
@@ -55,6 +262,48 @@ def main():
 		myutils.ERROR('Please specify exactly one of -p, -m, or -d.')
 	if args.dump_matrix is not None and args.descendents is None:
 		myutils.ERROR('--dump-matrix must be used with --descendents')
+	if args.group_dists is not None:
+		if args.descendents is None or args.groups is None:
+			myutils.ERROR('--group-dists must be used with --descendents and --groups')
+	if args.top_k is not None:
+		if args.descendents is None:
+			myutils.ERROR('--top-k must be used with --descendents')
+		if args.groups is not None or args.dump_matrix is not None:
+			myutils.ERROR('--top-k cannot be used with --groups or --dump-matrix')
+		if args.top_k <= 0:
+			myutils.ERROR('--top-k must be positive')
+	if args.project is not None:
+		if args.pca is None:
+			myutils.ERROR('--project must be used with --pca')
+		if args.pca_solver == 'incremental':
+			myutils.ERROR('--project cannot be used with --pca-solver incremental')
+		if not path.exists(args.project):
+			myutils.ERROR('{vcf} does not exist'.format(vcf = args.project))
+	if args.chunk_size is not None:
+		if args.descendents is None and args.project is None and \
+			args.pca_solver != 'incremental':
+			myutils.ERROR('--chunk-size must be used with --descendents, ' \
+				 '--project or --pca-solver incremental')
+		if args.chunk_size <= 0:
+			myutils.ERROR('--chunk-size must be positive')
+	if args.store is not None:
+		if args.descendents is None or args.top_k is not None:
+			myutils.ERROR('--store must be used with --descendents, without --top-k')
+		if args.chunk_size is not None or args.dump_matrix is not None or \
+			args.group_dists is not None:
+			myutils.ERROR('--store cannot be used with --chunk-size, ' \
+				 '--dump-matrix or --group-dists')
+		if not path.exists(path.dirname(args.store)):
+			myutils.ERROR('Directory for {store} does not exist'.format(
+				store = args.store))
+	if args.threads <= 0:
+		myutils.ERROR('--threads must be positive')
+	if args.samples is not None and args.descendents is None and \
+		args.project is None:
+		myutils.ERROR('--samples must be used with --descendents or --project')
+	for samples in [args.founder_samples, args.samples]:
+		if samples is not None and not path.exists(samples):
+			myutils.ERROR('{samples} does not exist'.format(samples = samples))
 	if not path.exists(args.founders):
 		myutils.ERROR('{founders} does not exist'.format(founders = args.founders))
 	if args.descendents is not None:
@@ -62,31 +311,123 @@ def main():
 			myutils.ERROR('{desc} does not exist'.format(desc = args.descendents))
 		if args.dump_matrix is not None and not path.exists(path.dirname(args.dump_matrix)):
 			myutils.ERROR('Directory for {matrix} does not exist'.format(matrix = args.dump_matrix))
+		if args.group_dists is not None and not path.exists(path.dirname(args.group_dists)):
+			myutils.ERROR('Directory for {dists} does not exist'.format(dists = args.group_dists))
 	if args.out is not None and not path.exists(path.dirname(args.out)):
 		myutils.ERROR('Directory for {out} does not exist'.format(out = args.out))
+	# only matrices may be written in other formats, and never to stdout
+	matrix_out = args.out if args.matrix else args.dump_matrix
+	if args.format is not None and args.format != 'tsv':
+		if not args.matrix and args.dump_matrix is None:
+			myutils.ERROR('--format must be used with -m or --dump-matrix')
+		if matrix_out is None:
+			myutils.ERROR('--format {format} needs an output file'.format(
+				format = args.format))
 	if args.groups is not None and args.pca is not None:
 		myutils.ERROR('Groups cannot be used in conjuction with PCA analysis')
+	if sum(map(bool, [args.chr, args.region, args.all_chroms])) > 1:
+		myutils.ERROR('Please specify at most one of -c, --region and --all-chroms')
+	if args.region is not None:
+		if tabix.parse_region(args.region) is None:
+			myutils.ERROR('{region} is not a valid region'.format(
+				region = args.region))
+		# a region is used just as a chromosome would be
+		args.chr = [args.region]
+	# several chromosomes are analysed one by one, each with its own outputs
+	several = args.all_chroms or (args.chr is not None and len(args.chr) > 1)
+	if args.combined is not None:
+		if not several or args.descendents is None or args.top_k is not None:
+			myutils.ERROR('--combined must be used with -d on several ' \
+				 'chromosomes, without --top-k')
+		if not path.exists(path.dirname(args.combined)):
+			myutils.ERROR('Directory for {out} does not exist'.format(
+				out = args.combined))
+	if several and args.out is None and args.combined is None:
+		myutils.ERROR('Several chromosomes need -o (or --combined) to name ' \
+			 'their outputs')
+	if args.profile is not None and not path.exists(path.dirname(args.profile)):
+		myutils.ERROR('Directory for {profile} does not exist'.format(
+			profile = args.profile))
+
+	# sample lists are passed on, so only their genotypes are ever parsed
+	if args.founder_samples is not None:
+		args.founder_samples = myutils.read_samples(args.founder_samples)
+	if args.samples is not None:
+		args.samples = myutils.read_samples(args.samples)
+
+	with myutils.profile(args.profile):
+		if not several:
+			analyse(args, None if args.chr is None else args.chr[0], args.out, 
+				args.dump_matrix, args.group_dists)
+		else:
+			analyse_chroms(args)
+	sys.exit(0)
+
+def analyse_chroms(args):
+	"""
+	Run the analysis asked for on each of several chromosomes
+	"""
+
+	# each VCF is read just once, and split by chromosome
+	files = [args.founders] + [file for file in [args.descendents, args.project] 
+		if file is not None]
+	samples = [args.founder_samples] + [args.samples] * (len(files) - 1)
+	matches = {}
+	with myutils.read_chroms(files, args.chr, samples) as chrs:
+		for chr in chrs:
+			outputs = [myutils.chrom_path(file, chr) for file in
+				[args.out, args.dump_matrix, args.group_dists]]
+			matches[chr] = analyse(args, chr, *outputs, 
+				write = args.out is not None)
+	if args.combined is not None:
+		import pandas as pd
+		# one column of matches per chromosome
+		myutils.print_df(pd.DataFrame(matches), args.combined, round = False)
+
+def analyse(args, chr, out, dump_matrix, group_dists, write = True):
+	"""
+	Run the analysis asked for on one chromosome, returning -d matches
+	"""
+
+	# the matrix writer opens its own file, as it may not be plain text
+	if not write: outf = None
+	elif args.matrix and out is not None: outf = out
+	else: outf = sys.stdout if out is None else open(out, 'w')
 	
-	outf = sys.stdout if args.out is None else open(args.out, 'w')
-	
+	matches = None
 	if args.matrix:
 		myutils.print_df(
-			myutils.dist_matrix(args.founders, args.chr, args.groups), outf
+			myutils.dist_matrix(args.founders, chr, args.groups, 
+			     threads = args.threads, 
+			     founder_samples = args.founder_samples), 
+			outf, format = args.format
 		)
-	if args.descendents is not None:
+	if args.top_k is not None:
 		myutils.print_df(
-			myutils.identify_founders(args.founders, args.descendents, args.chr,
-			     args.groups, args.dump_matrix), 
-				 outf, round = False, header = False
+			myutils.nearest_founders(args.founders, args.descendents, chr,
+			     args.top_k, chunk_size = args.chunk_size, 
+			     threads = args.threads, founder_samples = args.founder_samples,
+			     samples = args.samples), outf
 		)
+	elif args.descendents is not None:
+		matches = myutils.identify_founders(args.founders, args.descendents, 
+			chr, args.groups, dump_matrix, chunk_size = args.chunk_size,
+			threads = args.threads, group_dists = group_dists,
+			matrix_format = args.format, result_store = args.store,
+			founder_samples = args.founder_samples, samples = args.samples)
+		if outf is not None:
+			myutils.print_df(matches, outf, round = False, header = False)
 	if args.pca is not None:
-		e_vecs, e_vals = myutils.pca(args.founders, args.chr, args.pca)
+		e_vecs, e_vals = myutils.pca(args.founders, chr, args.pca, 
+			     args.pca_solver, args.chunk_size, args.project, 
+			     args.founder_samples, args.samples)
 		outf.write('\t'.join([str(round(e, ndigits = 4)) for e in e_vals]))
 		outf.write('\n')
 		myutils.print_df(e_vecs, outf, mode = 'a')
 	
-	outf.close()
-	sys.exit(0)
+	if outf is not None and outf is not out and outf is not sys.stdout: 
+		outf.close()
+	return matches
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -5,24 +5,114 @@ Has functions corresponding to each of inch.py's central analysis flags, an
 error function, and various helpers to make the analysis functions work.
 """
 
+# type annotations are not evaluated, so they need no imports to be loaded
+from __future__ import annotations
 # basic utilities
-from typing import Tuple
+from typing import Iterator, Tuple
 from itertools import chain
+# gzipped text output
+import gzip
+# fingerprint VCF files so cached genotypes are only used while up to date
+import hashlib
+import json
+import os
 # used to access stderr and force-kill the program
 import sys
+# time and memory of analysis stages, for profiling
+import time
+import resource
+import threading
+# spread distance computations over several cores
+from concurrent.futures import Executor, ThreadPoolExecutor, \
+    ProcessPoolExecutor
+from contextlib import contextmanager
+# founders are shared with batch worker processes through temporary files
+import tempfile
+# heavy libraries are loaded on first use, so that the command line starts
+# quickly and rejects bad arguments without waiting for them
+import importlib.util
+# seek straight to regions of bgzipped, indexed VCFs
+from inch import tabix
+# matches kept between runs, so unchanged descendents are not rescored
+from inch import store
+
+def _lazy_import(name: str):
+    """
+    Import a module, but only load it once one of its attributes is used
+
+    Parameters
+    ----------
+    name : str
+        Module name
+    
+    Returns
+	-------
+	module : ModuleType
+        The module, loaded already if it was imported elsewhere
+    """
+
+    if name in sys.modules: return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
 # clean VCF input
-import allel
+allel = _lazy_import('allel')
 # used for handling large amounts of data
-import pandas as pd
-import numpy as np
-# a function for computing distance matrices
-from sklearn.metrics import pairwise_distances
-# a class to do PCA
-from sklearn.decomposition import PCA
-from scipy.spatial.distance import hamming
+pd = _lazy_import('pandas')
+np = _lazy_import('numpy')
+# sklearn (distance matrices, PCA) and scipy (a genotype distance metric) are
+# imported where used
 
 # a simple encoding of DNA bases to numbers
 BASES = {'A' : 1, 'C': 2, 'G': 3, 'T': 4}
+# the only VCF fields used (numalt tells how many ALT columns are needed)
+VCF_FIELDS = ['samples', 'variants/CHROM', 'variants/POS', 'variants/REF', 
+              'variants/ALT', 'variants/numalt', 'calldata/GT']
+VCF_TYPES = {'variants/POS' : 'i4', 'calldata/GT' : 'i1'}
+# ALT columns parsed at first; VCFs with more ALTs somewhere are read again
+ALT_NUMBER = 3
+# repeats of a position are told apart by a count kept in this many low bits
+REPEAT_BITS = 16
+# ways to compute genotype distance matrices; the first is the default
+DIST_ENGINES = ['bitpacked', 'blocked', 'pairwise']
+# ways to run PCA; the first is the default. 'incremental' reads positions in
+# chunks and never holds all genotypes at once
+PCA_SOLVERS = ['auto', 'full', 'randomized', 'incremental']
+# how many positions incremental PCA reads at once, unless told otherwise
+PCA_CHUNK = 10000
+# how many positions the blocked distance engine handles at once, at most
+BLOCK_SITES = 1024
+# rough cap on the size of the arrays made for each block of distance work
+BLOCK_CELLS = 1 << 24
+# how many founders are compared to descendents at once when only the best
+# founder in each group is kept
+FOUNDER_BLOCK = 1024
+# how many descendents are compared to founders at once when only their
+# nearest founders are kept
+DESC_BLOCK = 1024
+# formats tables can be written in, by file extension; the first is the default
+# and only it can be written to an open stream. Binary ones hold float32 values
+OUT_FORMATS = {'tsv' : '.tsv', 'tsv.gz' : '.tsv.gz', 'npz' : '.npz', 
+               'parquet' : '.parquet'}
+# how many rows of a table are turned into text at once
+PRINT_ROWS = 4096
+# pre-encoded genotypes are stored next to the VCF in a directory with this
+# suffix, as memory-mappable arrays plus a JSON description of them
+INDEX_SUFFIX = '.inch'
+INDEX_ARRAYS = ['geno', 'pos', 'samples']
+INDEX_META = 'meta.json'
+# bumped whenever the index layout changes, so old indexes are ignored
+INDEX_VERSION = 2
+# founders and settings for the batch jobs of this process, by _batch_setup
+_BATCH = None
+# genotypes of VCFs read once and split by chromosome, by read_chroms
+_CHROM_GENO = {}
+# stages timed so far and those still running, while profile records them
+_PROFILE = None
 
 def ERROR(msg):
     """
@@ -35,9 +125,140 @@ def ERROR(msg):
     """
 
     sys.stderr.write('[ERROR]: {msg}\n'.format(msg = msg))
-    sys.exit(1)
+    error = SystemExit(1)
+    # kept for callers which catch errors and carry on, such as the server
+    error.msg = msg
+    raise error
+
+def LOG(msg):
+    """
+    Print an informational message
+
+    Parameters
+    ----------
+    msg : str
+        Message to print
+    """
+
+    sys.stderr.write('[INFO]: {msg}\n'.format(msg = msg))
+
+@contextmanager
+def profile(file: str = None) -> Iterator[dict]:
+    """
+    Record the time and memory taken by each stage run inside
+
+    Stages run in batch worker processes or threads are not recorded.
+
+    Parameters
+    ----------
+    file : str
+        If not None, where to write the record as JSON once done. If None, 
+        nothing is recorded unless another profile is already running.
+    
+    Returns
+	-------
+	record : dict
+        'stages', each stage's name (nested stages named after their parents,
+        e.g. 'get_geno/read_vcf') pointing to its number of 'calls', total
+        'wall_seconds' and 'cpu_seconds', 'peak_rss_mb' when it last ended and
+        the 'arrays' it last noted; and 'total' time and memory, once done
+    """
+
+    global _PROFILE
+    if file is None or _PROFILE is not None:
+        yield _PROFILE
+        return
+    _PROFILE = {'stages' : {}, 'open' : [], 'thread' : threading.get_ident()}
+    record = _PROFILE
+    start = (time.perf_counter(), time.process_time())
+    try:
+        yield record
+    finally:
+        _PROFILE = None
+        del record['open'], record['thread']
+        record['total'] = {'wall_seconds' : time.perf_counter() - start[0], 
+                           'cpu_seconds' : time.process_time() - start[1],
+                           'peak_rss_mb' : _peak_rss()}
+        with open(file, 'w') as out:
+            json.dump(record, out, indent = 2)
+            out.write('\n')
+
+@contextmanager
+def stage(name: str) -> Iterator:
+    """
+    Time a stage of analysis, if a profile is being recorded
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+    
+    Returns
+	-------
+	note : Callable
+        Takes arrays (or tables) as keyword arguments and records their shape,
+        type and size for the stage; does nothing when not profiling
+    """
+
+    if _PROFILE is None or _PROFILE['thread'] != threading.get_ident(): 
+        yield _ignore_arrays
+        return
+    _PROFILE['open'].append(name)
+    path = '/'.join(_PROFILE['open'])
+    record = _PROFILE['stages'].setdefault(path, {
+        'calls' : 0, 'wall_seconds' : 0.0, 'cpu_seconds' : 0.0, 'arrays' : {}})
+    start = (time.perf_counter(), time.process_time())
+    try:
+        yield lambda **arrays: record['arrays'].update(
+            {key : _array_size(value) for key, value in arrays.items()})
+    finally:
+        record['calls'] += 1
+        record['wall_seconds'] += time.perf_counter() - start[0]
+        record['cpu_seconds'] += time.process_time() - start[1]
+        record['peak_rss_mb'] = _peak_rss()
+        _PROFILE['open'].pop()
+
+def _ignore_arrays(**arrays) -> None:
+    """
+    Note arrays for a stage while not profiling, by doing nothing
+    """
+
+def _array_size(array) -> dict:
+    """
+    Describe the size of an array or table for a profile
+
+    Parameters
+    ----------
+    array : np.ndarray | pd.DataFrame | pd.Series
+        Array to describe
+    
+    Returns
+	-------
+	size : dict
+        Its 'shape', 'dtype' and size in memory ('mb')
+    """
+
+    if hasattr(array, 'to_numpy'): array = array.to_numpy()
+    return {'shape' : list(array.shape), 'dtype' : str(array.dtype), 
+            'mb' : array.nbytes / 2 ** 20}
+
+def _peak_rss() -> float:
+    """
+    Find the most memory this process has held so far
 
-def dist_matrix(founders: str, chr: str, groups: list[str]) -> pd.DataFrame:
+    Returns
+	-------
+	peak : float
+        Peak resident set size, in MB
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, but macOS bytes
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+def dist_matrix(founders: str, chr: str, groups: list[str],
+                engine: str = DIST_ENGINES[0], threads: int = 1,
+                founder_samples: list[str] = None) -> pd.DataFrame:
     """
     Calculate pairwise distances between all founders, perhaps grouped
 
@@ -46,10 +267,17 @@ def dist_matrix(founders: str, chr: str, groups: list[str]) -> pd.DataFrame:
     founders : str
         VCF file with founder genotypes
     chr : str
-        Chromosome to use from the VCF file (None means to use all)
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
     groups : list[str]
         Founders to group together during distance computation.
         Each list item is a group; IDs with a group are comma-separated.
+    engine : str
+        How to compute distances (one of DIST_ENGINES). Default 'bitpacked'.
+    threads : int
+        How many threads to split founders across. Default 1.
+    founder_samples : list[str]
+        IDs of the founders to use (None means to use all)
     
     Returns
 	-------
@@ -57,14 +285,17 @@ def dist_matrix(founders: str, chr: str, groups: list[str]) -> pd.DataFrame:
         n x n matrix (labeled) of Hamming distances between founders/groups
     """
 
-    geno = _get_geno(founders, chr)[0]
+    geno = _get_geno(founders, chr, founder_samples)[0]
     # process groups early to avoid unnecessary computation if they error
     if groups is not None: groups = _make_groups(set(geno.columns), groups)
     # founder v founder distances
-    matrix = _geno_dists(geno, geno)
+    matrix = _geno_dists(geno, geno, engine, threads)
     return matrix if groups is None else _merge_matrix_groups(matrix, groups)
 
-def pca(founders: str, chr: str, n_pc: int) -> Tuple[pd.DataFrame, np.ndarray]:
+def pca(founders: str, chr: str, n_pc: int, solver: str = PCA_SOLVERS[0],
+        chunk_size: int = None, project: str = None, 
+        founder_samples: list[str] = None, 
+        samples: list[str] = None) -> Tuple[pd.DataFrame, np.ndarray]:
     """
     Run PCA on samples
 
@@ -73,35 +304,264 @@ def pca(founders: str, chr: str, n_pc: int) -> Tuple[pd.DataFrame, np.ndarray]:
     founders : str
         VCF file with founders genotypes
     chr : str
-        Chromosome to use from the VCF file (None means to use all)
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
     n_pc : int
         How many principle components to calculate
+    solver : str
+        How to calculate them (one of PCA_SOLVERS). Default 'auto'.
+    chunk_size : int
+        How many positions the incremental solver, or projection, reads at
+        once. Default PCA_CHUNK.
+    project : str
+        If not None, a VCF file of other samples (e.g. descendents) to place
+        on the founders' PCs, without changing them. Not with 'incremental'.
+    founder_samples : list[str]
+        IDs of the founders to use (None means to use all)
+    samples : list[str]
+        IDs of the samples in project to place (None means to place all)
     
     Returns
 	-------
 	eigenvectors : pd.DataFrame
-        k samples x n PCs table of each sample's weight along each PC
+        k samples x n PCs table of each sample's weight along each PC,
+        followed by projected samples
     eigenvalues : np.ndarray
         eigenvalues for each PC in decreasing order (PC1, PC2, ...)
     """
 
-    geno = _get_geno(founders, chr)[0]
+    if chunk_size is None: chunk_size = PCA_CHUNK
+    if project is not None and solver == 'incremental':
+        ERROR('Samples cannot be projected onto incremental PCA')
+    if solver == 'incremental':
+        return _incremental_pca(founders, chr, n_pc, chunk_size, 
+                                founder_samples)
+    if solver not in PCA_SOLVERS:
+        ERROR('Unknown PCA solver {solver}'.format(solver = solver))
+    geno, founder_chr = _get_geno(founders, chr, founder_samples)
+
+    _check_n_pc(n_pc, min(geno.shape))
+    with stage('fit_pca') as note:
+        # PCA requires the rows to be samples and the columns to be features
+        geno = geno.transpose().astype(np.float32)
+        # the PCA model must be pre-initialized with how many components
+        from sklearn.decomposition import PCA
+        pca = PCA(n_components = n_pc, svd_solver = solver, random_state = 0)
+        pca.fit(geno)
+        # extract weights for each sample along the eigenvectors
+        eigenvec = pd.DataFrame(pca.transform(geno), index = geno.index,
+                                columns = ['PC' + str(i + 1) 
+                                           for i in range(n_pc)])
+        note(geno = geno, eigenvectors = eigenvec)
+    if project is not None:
+        projected = _project(pca, geno.columns.values, founder_chr, project, 
+                             chr, chunk_size, samples)
+        eigenvec = pd.concat([eigenvec, projected.set_axis(eigenvec.columns, 
+                                                           axis = 1)])
+    return eigenvec, pca.explained_variance_
+
+def _check_n_pc(n_pc: int, max_n: int) -> None:
+    """
+    Die unless a number of PCs can be calculated
+
+    Parameters
+    ----------
+    n_pc : int
+        How many principle components were asked for
+    max_n : int
+        Most PCs there can be (fewest of samples and positions)
+    """
 
-    if n_pc > min(geno.shape) or 0 >= n_pc:
+    if n_pc > max_n or 0 >= n_pc:
         ERROR('Cannot calculate {n} PCs: must be between 1 and {min_n}'.format(
-            n = n_pc, min_n = min(geno.shape)))
-    # PCA requires the rows to be samples and the columns to be features
-    geno = geno.transpose()
-    # the PCA model must be pre-initialized with how many components to extract
-    pca = PCA(n_components = n_pc)
-    pca.fit(geno)
-    # extract weights for each sample along the eigenvectors
-    eigenvec = pd.DataFrame(pca.transform(geno), index = geno.index,
+            n = n_pc, min_n = max_n))
+
+def _project(pca: PCA, pos: np.ndarray, founder_chr: str, file: str, 
+             chr: str, chunk_size: int, 
+             samples: list[str] = None) -> pd.DataFrame:
+    """
+    Place samples on already-fitted PCs, reading them a chunk at a time
+
+    A sample's weights are sums over positions, so each chunk adds its part
+    and only the weights are kept between chunks. Positions the founders have
+    but the samples lack are taken to be at the founders' mean.
+
+    Parameters
+    ----------
+    pca : PCA
+        PCA fitted on founder genotypes
+    pos : np.ndarray
+        Founder positions, in the order of the PCA's features
+    founder_chr : str
+        Chromosome the founder genotypes are from
+    file : str
+        VCF file with genotypes of samples to place
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    chunk_size : int
+        How many positions to hold in memory at once
+    samples : list[str]
+        IDs of the samples to place (None means to place all)
+    
+    Returns
+	-------
+	eigenvectors : pd.DataFrame
+        n samples x n PCs table of each sample's weight along each PC
+    """
+
+    samples, chunks = _geno_chunks(file, chr, chunk_size, samples)
+    match = _chunk_matcher(pos)
+    weights = np.zeros((len(samples), pca.n_components_))
+    n_shared, n_samples = 0, 0
+    for chunk_chr, chunk_pos, chunk in chunks:
+        if chunk_chr != founder_chr:
+            ERROR('Founder and projected samples have different chromosomes')
+        n_samples += len(chunk_pos)
+        shared, rows = match(chunk_pos)
+        if not shared.any(): continue
+        n_shared += shared.sum()
+        centered = chunk[shared].astype(np.float32) - pca.mean_[rows, None]
+        weights += centered.T @ pca.components_[:, rows].T
+    _report_sites(n_shared, len(pos), n_samples)
+    return pd.DataFrame(weights, index = samples)
+
+def _geno_chunks(file: str, chr: str, chunk_size: int, 
+                 samples: list[str] = None
+                 ) -> Tuple[np.ndarray, Iterator[Tuple[str, np.ndarray, 
+                                                       np.ndarray]]]:
+    """
+    Read encoded genotypes a chunk of positions at a time
+
+    Uses genotypes from read_chroms or an up-to-date index if there are
+    any, else reads the VCF itself.
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    chunk_size : int
+        How many positions to hold in memory at once
+    samples : list[str]
+        IDs of the samples to use (None means to use all)
+    
+    Returns
+	-------
+	samples : np.ndarray
+        IDs of the samples used from the VCF
+    chunks : Iterator[Tuple[str, np.ndarray, np.ndarray]]
+        Chromosome, positions and k positions x n samples genotypes of each
+        chunk
+    """
+
+    index = _cached_geno(file, chr, samples)
+    if index is None: index = _load_index(file, chr, samples)
+    if index is not None:
+        # memory-mapped genotypes are only read in as each chunk is used
+        geno, found_chr = index
+        return geno.columns.values, ((found_chr, 
+                                      geno.index.values[start:start + 
+                                                        chunk_size], 
+                                      geno.values[start:start + chunk_size])
+                                     for start in range(0, len(geno), 
+                                                        chunk_size))
+    samples, chunks = _iter_vcf(file, chr, chunk_size, samples)
+    return samples, ((chunk['variants/CHROM'][0], chunk['variants/POS'], 
+                      _decode_geno(chunk)) 
+                     for chunk in _one_chr_chunks(chunks, file, chr))
+
+def _incremental_pca(file: str, chr: str, n_pc: int, chunk_size: int,
+                     samples: list[str] = None
+                     ) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Run PCA on samples, reading their genotypes a chunk of positions at a time
+
+    Samples are few next to positions, so the samples x samples Gram matrix of
+    centered genotypes is summed over chunks and its eigenvectors, scaled by
+    the square roots of its eigenvalues, give each sample's PC weights.
+
+    Parameters
+    ----------
+    file : str
+        VCF file with genotypes
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    n_pc : int
+        How many principle components to calculate
+    chunk_size : int
+        How many positions to hold in memory at once
+    samples : list[str]
+        IDs of the samples to use (None means to use all)
+    
+    Returns
+	-------
+	eigenvectors : pd.DataFrame
+        k samples x n PCs table of each sample's weight along each PC
+    eigenvalues : np.ndarray
+        eigenvalues for each PC in decreasing order (PC1, PC2, ...)
+    """
+
+    samples, chunks = _geno_chunks(file, chr, chunk_size, samples)
+    # fail before reading anything if there are too few samples
+    _check_n_pc(n_pc, len(samples))
+
+    gram = np.zeros((len(samples), len(samples)))
+    n_sites = 0
+    for _, _, chunk in chunks:
+        n_sites += len(chunk)
+        # each position is centered on its mean over samples
+        chunk = chunk.astype(np.float32)
+        chunk -= chunk.mean(axis = 1, keepdims = True)
+        gram += chunk.T @ chunk
+    _check_n_pc(n_pc, min(len(samples), n_sites))
+
+    values, vectors = np.linalg.eigh(gram)
+    values, vectors = values[::-1][:n_pc], vectors[:, ::-1][:, :n_pc]
+    # PC signs are arbitrary: fix them so each PC's largest weight is positive
+    signs = np.sign(vectors[np.abs(vectors).argmax(axis = 0), 
+                            range(n_pc)])
+    weights = vectors * signs * np.sqrt(np.clip(values, 0, None))
+    eigenvec = pd.DataFrame(weights, index = samples,
                             columns = ['PC' + str(i + 1) for i in range(n_pc)])
-    return eigenvec, pca.explained_variance_
+    return eigenvec, values / max(1, len(samples) - 1)
+
+def _one_chr_chunks(chunks: Iterator[dict], file: str, 
+                    chr: str) -> Iterator[dict]:
+    """
+    Pass on VCF chunks, dying if they span several chromosomes or none
+
+    Parameters
+    ----------
+    chunks : Iterator[dict]
+        Parsed VCF fields for each chunk, as from _iter_vcf
+    file : str
+        VCF filename
+    chr : str
+        Chromosome (or CHR:START-END region) that was read
+    """
+
+    chrs = set()
+    for chunk in chunks:
+        chrs.update(chunk['variants/CHROM'])
+        if len(chrs) > 1:
+            ERROR('More than one chromosome detected in VCF file. ' \
+                  'Must specify one chromosome to use.')
+        yield chunk
+    if not chrs:
+        ERROR("No variants in {file} on {chr}".format(file = file, chr = chr))
 
 def identify_founders(founders: str, descendents: str, chr: str, 
-                      groups: list[str], dump_matrix: str) -> pd.Series:
+                      groups: list[str], dump_matrix: str,
+                      engine: str = DIST_ENGINES[0],
+                      chunk_size: int = None, threads: int = 1,
+                      group_dists: str = None, matrix_format: str = None,
+                      result_store: str = None, 
+                      founder_samples: list[str] = None,
+                      samples: list[str] = None) -> pd.Series:
     """
     Identify which founder a descendent matches best
 
@@ -112,13 +572,37 @@ def identify_founders(founders: str, descendents: str, chr: str,
     descendents : str
         VCF file with descendent genotypes
     chr : str
-        Chromosome to use from the VCF files (None means to use all)
+        Chromosome (or CHR:START-END region) to use from the VCF files (None 
+        means to use all)
     groups : list[str]
         Founders to group together during final assignment.
         Each list item is a group; IDs with a group are comma-separated.
     dump_matrix: str
         If not None, the distance matrix of each descendent to each founder will
         be written to the file specified.
+    engine : str
+        How to compute distances (one of DIST_ENGINES). Default 'bitpacked'.
+        When streaming, 'pairwise' is replaced by 'blocked'.
+    chunk_size : int
+        If not None, stream descendents from their VCF this many positions at
+        a time rather than loading them all at once.
+    threads : int
+        How many threads to split descendents across. Default 1.
+    group_dists : str
+        If not None, the distance of each descendent to the closest member of
+        each group will be written to the file specified. Needs groups.
+    matrix_format : str
+        Format to write dump_matrix in (one of OUT_FORMATS). Default from the
+        extension of dump_matrix.
+    result_store : str
+        If not None, a SQLite file of earlier matches. Descendents whose 
+        genotypes, and founders, are unchanged since they were stored are not
+        matched again; new matches are added. Not with chunk_size, dump_matrix
+        or group_dists.
+    founder_samples : list[str]
+        IDs of the founders to use (None means to use all)
+    samples : list[str]
+        IDs of the descendents to use (None means to use all)
     
     Returns
 	-------
@@ -126,192 +610,1676 @@ def identify_founders(founders: str, descendents: str, chr: str,
         The founder ID best matching each descendent (descendent IDs in index)
     """
 
-    founders, founder_chr = _get_geno(founders, chr)
+    if result_store is not None and (chunk_size is not None or 
+                                     dump_matrix is not None or 
+                                     group_dists is not None):
+        ERROR('Stored matches cannot be used with streaming or matrix outputs')
+    founders, founder_chr = _get_geno(founders, chr, founder_samples)
     # process groups early to avoid unnecessary computation if they error
     if groups is not None:
         groups = _make_groups(set(founders.columns), groups)
         # dictionary with each founder ID pointing to its group's string
         groups = {id : ','.join(group) for group in groups for id in group}
-    desc, desc_chr = _get_geno(descendents, chr)
-
-    if desc_chr != founder_chr:
-        ERROR('Founder and descendents have different chromosomes')
-    if not set(founders.index).intersection(set(desc.index)):
-        ERROR('Founders and descendents share no positions')
+    elif group_dists is not None:
+        ERROR('Group distances need founder groups')
+    return _identify(founders, founder_chr, descendents, chr, groups, 
+                     dump_matrix, engine, chunk_size, threads, group_dists, 
+                     matrix_format, result_store, samples)
 
-    # filter down to only shared positions
-    founders = founders.filter(items = desc.index, axis = 0)
-    desc = desc.filter(items = founders.index, axis = 0)
-
-    # select closest founder to each desc using all founder v desc distances
-    matrix = _geno_dists(desc, founders)
-    if dump_matrix is not None: print_df(matrix, dump_matrix)
-    matches = matrix.idxmin(axis = 1)
-    return matches if groups is None else matches.replace(groups)
-
-def print_df(df: pd.DataFrame, out, round = True,
-             header: bool = True, mode: str = 'w') -> None:
-    """
-    Pretty-print a Pandas data frame
-
-    Parameters
-    ----------
-    df : pd.DataFrame
-        Data to print
-    out : FilePath | WriteBuffer[bytes] | WriteBuffer[str]
-        Where to write the data to
-    round : bool
-        Whether to round the data. Default True.
-    header : bool
-        Whether to print the header/column names. Default True.
-    mode: str
-        What mode to print the data in. Default 'w'.
+def identify_batch(founders: str, descendents: list[str], chr: str,
+                   groups: list[str], jobs: int = 1, 
+                   engine: str = DIST_ENGINES[0], chunk_size: int = None, 
+                   threads: int = 1) -> Iterator[Tuple[str, pd.Series]]:
     """
+    Identify which founder each descendent matches best, for many VCF files
 
-    if round: df = df.round(decimals = 4)
-    df.to_csv(out, sep = '\t', header = header, mode = mode)
+    Founders are read once. With several jobs, they are saved to a temporary
+    directory which every worker process memory-maps, so all share one copy.
 
-def _hamming_ignore_missing(x: list[int], y: list[int]) -> int:
-    """
-    Calculate Hamming distance between genotypes ignoring missing positions
     Parameters
     ----------
-    x : list[int]
-        One numeric genotype
-    y : list[int]
-        Another numeric genotype
+    founders : str
+        VCF file with founder genotypes
+    descendents : list[str]
+        VCF files with descendent genotypes
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF files (None 
+        means to use all)
+    groups : list[str]
+        Founders to group together during final assignment.
+        Each list item is a group; IDs with a group are comma-separated.
+    jobs : int
+        How many descendent files to work on at once, in separate processes.
+        Default 1.
+    engine : str
+        How to compute distances (one of DIST_ENGINES). Default 'bitpacked'.
+    chunk_size : int
+        If not None, stream descendents from their VCFs this many positions at
+        a time rather than loading them all at once.
+    threads : int
+        How many threads each job splits descendents across. Default 1.
     
     Returns
 	-------
-	dist : int
-        Hamming distance between x and y excluding positions where either is NA
+	matches : Iterator[Tuple[str, pd.Series]]
+        Each descendent file, in order, with the founder ID best matching each
+        of its descendents (descendent IDs in index)
     """
-    
-    return hamming(x, y, np.where(np.logical_or(x == 0, y == 0), 0, 1))
 
-def _make_groups(founder_ids: set[str], groups: list[str]) -> list[list[str]]:
+    with founder_pool(founders, chr, groups, jobs, engine, chunk_size, 
+                      threads) as pool:
+        yield from zip(descendents, pool.map(batch_identify, descendents))
+
+@contextmanager
+def founder_pool(founders: str, chr: str, groups: list[str], jobs: int = 1,
+                 engine: str = DIST_ENGINES[0], chunk_size: int = None, 
+                 threads: int = 1) -> Iterator[Executor]:
     """
-    Process input groups to create final final groups
+    Read founders once and start workers which can match descendents to them
+
+    With several jobs, founders are saved to a temporary directory which every
+    worker process memory-maps, so all share one copy. With one, the work is
+    done by a single thread of this process.
 
     Parameters
     ----------
-    founder_ids : set[str]
-        All founder IDs
+    founders : str
+        VCF file with founder genotypes
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF files (None 
+        means to use all)
     groups : list[str]
-        Founders to group together. Must not be None.
+        Founders to group together during final assignment.
         Each list item is a group; IDs with a group are comma-separated.
+    jobs : int
+        How many descendent files to work on at once. Default 1.
+    engine : str
+        How to compute distances (one of DIST_ENGINES). Default 'bitpacked'.
+    chunk_size : int
+        If not None, stream descendents from their VCFs this many positions at
+        a time rather than loading them all at once.
+    threads : int
+        How many threads each job splits descendents across. Default 1.
     
     Returns
 	-------
-	groups : list[list[str]]
-        Sublists are groups and sublist items are founder IDs. 
-        All IDs are in exactly one group.
+	pool : Executor
+        Workers to give batch_identify jobs to, shut down on leaving
     """
 
-    # turn input groups into a ragged array
-    groups = [group.split(',') for group in groups]
-    flat_groups = list(chain.from_iterable(groups))
+    founders, founder_chr = _get_geno(founders, chr)
+    if groups is not None:
+        groups = _make_groups(set(founders.columns), groups)
+        groups = {id : ','.join(group) for group in groups for id in group}
+    settings = (founder_chr, chr, groups, engine, chunk_size, threads)
+    if jobs == 1:
+        _batch_setup(founders, *settings)
+        with ThreadPoolExecutor(1) as pool: yield pool
+        return
 
-    if len(flat_groups) != len(set(flat_groups)):
-        ERROR('Some groups contain duplicate founder IDs')
-    if not set(flat_groups).issubset(founder_ids):
-        ERROR('Some groups contain nonexistant founder IDs')
-    
-    # make a new group for each ID which appears in no group
-    [groups.append([id]) for id in founder_ids if id not in flat_groups]
-    return groups
+    with tempfile.TemporaryDirectory() as shared:
+        arrays = [founders.values, founders.index.values, 
+                  founders.columns.values.astype(str)]
+        for name, array in zip(INDEX_ARRAYS, arrays):
+            np.save(os.path.join(shared, name + '.npy'), array)
+        with ProcessPoolExecutor(jobs, initializer = _batch_setup, 
+                                 initargs = (shared, *settings)) as pool:
+            yield pool
 
-def _geno_dists(row_geno: pd.DataFrame, col_geno: pd.DataFrame) -> pd.DataFrame:
+def _identify(founders: pd.DataFrame, founder_chr: str, descendents: str, 
+              chr: str, groups: dict[str, str], dump_matrix: str, 
+              engine: str, chunk_size: int, threads: int, group_dists: str, 
+              matrix_format: str, result_store: str = None, 
+              samples: list[str] = None) -> pd.Series:
     """
-    Calculate pairwise distances between sample genotypes
+    Identify which founder a descendent matches best, given loaded founders
+
+    Parameters are as for identify_founders, except that founders is the
+    k positions x n founders table of numeric genotypes (already limited to
+    founder_samples), founder_chr is its chromosome and groups, if not None,
+    points each founder ID to its group's string.
 
-    Parameters
-    ----------
-    row_geno:
-        k positions x n_row table of genotypes for samples to be output rows
-    col_geno:
-        k positions x n_col table of genotypes for samples to be output columns
-    
     Returns
 	-------
-	matrix : pd.DataFrame
-        n_row x n_col matrix (labeled) of Hamming distances between samples
+	matches : pd.Series
+        The founder ID best matching each descendent (descendent IDs in index)
     """
 
-    # sklearn requires samples to be rows and features to be columns
-    matrix = pairwise_distances(row_geno.transpose(), col_geno.transpose(), 
-                                metric = _hamming_ignore_missing)
-    # label samples before returning the matrix
-    return pd.DataFrame(matrix, index = row_geno.columns, 
-                        columns = col_geno.columns)
+    if chunk_size is not None:
+        return _assign(_stream_dists(founders, founder_chr, descendents, chr, 
+                                     chunk_size, threads, engine, samples), 
+                       groups, dump_matrix, group_dists, matrix_format)
+    founders, desc = _shared_geno(founders, founder_chr, descendents, chr, 
+                                  samples)
+    if result_store is not None:
+        return _stored_matches(founders, desc, groups, engine, threads, 
+                               result_store)
+    return _match_shared(founders, desc, groups, dump_matrix, engine, threads,
+                         group_dists, matrix_format)
 
-def _merge_matrix_groups(matrix: pd.DataFrame, 
-                         groups: list[list[str]]) -> pd.DataFrame:
+def _match_shared(founders: pd.DataFrame, desc: pd.DataFrame, 
+                  groups: dict[str, str], dump_matrix: str, engine: str, 
+                  threads: int, group_dists: str, 
+                  matrix_format: str) -> pd.Series:
     """
-    Merge groups in a distance matrix by averaging distance between members
+    Identify which founder a descendent matches best, given genotypes at
+    shared positions
+
+    Parameters are as for _identify, except that founders and desc are the
+    k positions x n table of numeric genotypes of each, at the same positions.
 
-    Parameters
-    ----------
-    matrix : pd.DataFrame
-        n x n matrix (labeled) of Hamming distances between founders
-    groups : list[list[str]]
-        Sublists are groups and sublist items are founder IDs. Must not be None.
-        All IDs are in exactly one group.
-    
     Returns
 	-------
-	merged : pd.DataFrame
-        n groups x n groups matrix (labeled) of Hamming distances between groups
+	matches : pd.Series
+        The founder ID best matching each descendent (descendent IDs in index)
     """
 
-    # dictionary with each group's string pointing to its list of IDs
-    groups = {','.join(group) : group for group in groups}
-    merged = pd.DataFrame(0, index = groups.keys(), columns = groups.keys())
+    # with groups, only the best founder in each is needed, so founders
+    # can be compared a block at a time without keeping the whole matrix
+    if groups is not None and dump_matrix is None:
+        return _group_search(_founder_blocks(desc, founders, engine, threads),
+                             desc.columns, founders.columns, groups, 
+                             group_dists)
 
-    def dist(row, col):
-        # calculate distance at row,col in the merged distance matrix
-        # main diagonal is manually set to 0 and not average in-group distance
-        return 0 if row == col else \
-            matrix.loc[groups[row]][groups[col]].mean(axis = 0).mean()
-    
-    # average between each group's members in the merged distance matrix
-    return merged.apply(lambda x: [dist(row, x.name) for row in x.index])
+    # select closest founder to each desc using all founder v desc distances
+    return _assign(_geno_dists(desc, founders, engine, threads), groups, 
+                   dump_matrix, group_dists, matrix_format)
 
-def _to_code(geno: str) -> int:
+def _stored_matches(founders: pd.DataFrame, desc: pd.DataFrame, 
+                    groups: dict[str, str], engine: str, threads: int, 
+                    file: str) -> pd.Series:
     """
-    Convert a genotype to a number
+    Identify which founder a descendent matches best, reusing stored matches
+    for descendents whose genotypes and founders are unchanged
 
     Parameters
     ----------
-    geno: str
-        An allele's genotype (from a VCF file, REF or ALT columns)
-    
+    founders : pd.DataFrame
+        k positions x n founders table of numeric genotypes
+    desc : pd.DataFrame
+        k positions x m descendents table of numeric genotypes, at the same 
+        positions
+    groups : dict[str, str]
+        Each founder ID pointing to its group's string, or None
+    engine : str
+        How to compute distances (one of DIST_ENGINES)
+    threads : int
+        How many threads to split descendents across
+    file : str
+        Result store filename, updated with newly found matches
+
     Returns
 	-------
-	code : int
-        A numeric code corresponding to this genotype
+	matches : pd.Series
+        The founder ID best matching each descendent (descendent IDs in index)
     """
-        
-    # missingness due to an upstream deletion
-    if geno == '*': return -1
-    # build up numeric code for allele as if ACGT is 1234 in base-5
-    code = 0
-    for base in geno:
-        if base not in BASES:
-            ERROR('Invalid base {base} in REF or ALT'.format(base = base))
-        code = code * 5 + BASES[base]
-    return code
 
-def _get_geno(file: str, chr: str) -> Tuple[pd.DataFrame, str]:
-    """
-    Extract unambiguous numeric genotypes from a VCF file
+    panel = store.panel_key(founders, groups)
+    keys = store.geno_keys(desc)
+    stored = store.lookup(file, panel)
+    new = np.array([key not in stored for key in keys], dtype = bool)
+    LOG('{old} descendents unchanged; matching {new}'.format(
+        old = len(keys) - new.sum(), new = new.sum()))
+
+    if new.any():
+        found = _match_shared(founders, desc.iloc[:, new], groups, None, 
+                              engine, threads, None, None)
+        fresh = {key : None if pd.isna(match) else match 
+                 for key, match in zip(np.array(keys)[new], found.values)}
+        store.save(file, panel, fresh)
+        stored.update(fresh)
+    # descendents matching no founder are stored without a match
+    return pd.Series([np.nan if stored[key] is None else stored[key] 
+                      for key in keys], index = desc.columns)
+
+def _assign(matrix: pd.DataFrame, groups: dict[str, str], dump_matrix: str, 
+            group_dists: str, matrix_format: str) -> pd.Series:
+    """
+    Pick each descendent's best founder from its distances to all of them
+
+    Parameters are as for _identify, except that matrix is the n descendents 
+    x m founders distance matrix.
+
+    Returns
+	-------
+	matches : pd.Series
+        The founder ID best matching each descendent (descendent IDs in index)
+    """
+
+    if dump_matrix is not None: 
+        print_df(matrix, dump_matrix, format = matrix_format)
+    if groups is not None:
+        return _group_search([matrix.values], matrix.index, matrix.columns, 
+                             groups, group_dists)
+    return matrix.idxmin(axis = 1)
+
+def _batch_setup(founders, *settings) -> None:
+    """
+    Keep founders and settings where each batch job can find them
+
+    Parameters
+    ----------
+    founders : pd.DataFrame | str
+        k positions x n founders table of numeric genotypes, or a directory
+        of them saved as in an index, to be memory-mapped
+    settings : Tuple
+        Founder chromosome, then the chr, groups, engine, chunk_size and
+        threads arguments of founder_pool
+    """
+
+    global _BATCH
+    if isinstance(founders, str):
+        geno, pos, samples = [np.load(os.path.join(founders, name + '.npy'), 
+                                      mmap_mode = 'r') 
+                              for name in INDEX_ARRAYS]
+        founders = pd.DataFrame(geno, index = pos, columns = samples, 
+                                copy = False)
+    _BATCH = (founders, *settings)
+
+def batch_identify(descendents: str) -> pd.Series:
+    """
+    Identify which founder each descendent in a file matches best, as a job
+    run by the workers of a founder_pool
+
+    Parameters
+    ----------
+    descendents : str
+        VCF file with descendent genotypes
+    
+    Returns
+	-------
+	matches : pd.Series
+        The founder ID best matching each descendent (descendent IDs in index)
+    """
+
+    founders, founder_chr, chr, groups, engine, chunk_size, threads = _BATCH
+    return _identify(founders, founder_chr, descendents, chr, groups, None, 
+                     engine, chunk_size, threads, None, None)
+
+def nearest_founders(founders: str, descendents: str, chr: str, k: int,
+                     engine: str = DIST_ENGINES[0], chunk_size: int = None, 
+                     threads: int = 1, founder_samples: list[str] = None,
+                     samples: list[str] = None) -> pd.DataFrame:
+    """
+    Find the k founders nearest to each descendent
+
+    Parameters
+    ----------
+    founders : str
+        VCF file with founder genotypes
+    descendents : str
+        VCF file with descendent genotypes
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF files (None 
+        means to use all)
+    k : int
+        How many founders to report for each descendent
+    engine : str
+        How to count mismatches (one of DIST_ENGINES, where 'pairwise' means
+        'blocked'). Default 'bitpacked'.
+    chunk_size : int
+        If not None, stream descendents from their VCF this many positions at
+        a time rather than loading them all at once.
+    threads : int
+        How many threads to split descendents across. Default 1.
+    founder_samples : list[str]
+        IDs of the founders to use (None means to use all)
+    samples : list[str]
+        IDs of the descendents to use (None means to use all)
+    
+    Returns
+	-------
+	nearest : pd.DataFrame
+        For each descendent (descendent IDs in index), the founder, distance
+        and number of mutually called positions of its k nearest founders,
+        closest first, then the margin from the best distance to the second
+    """
+
+    founders, founder_chr = _get_geno(founders, chr, founder_samples)
+    if not 0 < k <= founders.shape[1]:
+        ERROR('Cannot report {k} nearest founders: must be between 1 and '
+              '{n}'.format(k = k, n = founders.shape[1]))
+    # the pairwise engine computes whole distances, not counts
+    if engine == 'pairwise': engine = 'blocked'
+
+    # counts are ranked DESC_BLOCK descendents at a time. Streaming reads the
+    # VCF once, so its mismatch and valid counts cover every descendent: two
+    # n descendents x n founders int64 arrays, however small the chunks.
+    # Loaded genotypes are compared a block at a time, so only DESC_BLOCK
+    # rows of counts are held at once
+    if chunk_size is not None:
+        samples, mismatch, valid = _stream_counts(
+            founders, founder_chr, descendents, chr, chunk_size, threads, 
+            engine, samples)
+        blocks = ((mismatch[start:start + DESC_BLOCK], 
+                   valid[start:start + DESC_BLOCK]) 
+                  for start in range(0, len(samples), DESC_BLOCK))
+    else:
+        founders, desc = _shared_geno(founders, founder_chr, descendents, chr,
+                                      samples)
+        samples = desc.columns
+        panel = _founder_panel(founders.values)
+        blocks = (_panel_counts(desc.values[:, start:start + DESC_BLOCK], 
+                                founders.values, threads, engine, panel)
+                  for start in range(0, len(samples), DESC_BLOCK))
+    parts = [_top_k(block_mismatch, block_valid, k) 
+             for block_mismatch, block_valid in blocks]
+    best, dists, sites, margin = (np.concatenate(part) 
+                                  for part in zip(*parts))
+
+    # interleave each rank's founder, distance and site count
+    nearest = pd.DataFrame(index = samples)
+    for rank in range(k):
+        suffix = '_' + str(rank + 1)
+        nearest['founder' + suffix] = founders.columns[best[:, rank]]
+        nearest['distance' + suffix] = dists[:, rank]
+        nearest['sites' + suffix] = sites[:, rank]
+    nearest['margin'] = margin
+    return nearest
+
+@contextmanager
+def read_chroms(files: list[str], chrs: list[str], 
+                samples: list[list[str]] = None) -> Iterator[list[str]]:
+    """
+    Read VCF files once each, split by chromosome, for analyses to reuse
+
+    While open, analyses of any of these files on one of the chromosomes use
+    the genotypes read here instead of reading the file again.
+
+    Parameters
+    ----------
+    files : list[str]
+        VCF filenames
+    chrs : list[str]
+        Chromosomes to keep (None means to keep all)
+    samples : list[list[str]]
+        For each file, IDs of the samples analyses will use (None means all).
+        A file given twice keeps the samples of both.
+    
+    Returns
+	-------
+	chrs : list[str]
+        Chromosomes to analyse: chrs, or else all those in the first file
+    """
+
+    keep = {}
+    for file, selected in zip(files, samples or [None] * len(files)):
+        if selected is None or keep.get(file, []) is None: keep[file] = None
+        else: keep[file] = keep.get(file, []) + list(selected)
+    for file, selected in keep.items(): 
+        _CHROM_GENO[file] = _split_geno(file, chrs, selected)
+    try:
+        yield list(_CHROM_GENO[files[0]]) if chrs is None else chrs
+    finally:
+        for file in files: _CHROM_GENO.pop(file, None)
+
+def chrom_path(file: str, chr: str) -> str:
+    """
+    Name a chromosome's output file after the one asked for
+
+    Parameters
+    ----------
+    file : str
+        Output filename, or None
+    chr : str
+        Chromosome
+    
+    Returns
+	-------
+	file : str
+        file with the chromosome inserted before its extension (None if file
+        is None), e.g. out.Y.tsv for out.tsv
+    """
+
+    if file is None: return None
+    extensions = sorted(OUT_FORMATS.values(), key = len, reverse = True)
+    extension = next((ext for ext in extensions if file.endswith(ext)), '')
+    stem = file[:len(file) - len(extension)]
+    return '{stem}.{chr}{extension}'.format(stem = stem, chr = chr, 
+                                            extension = extension)
+
+def index_vcf(file: str, chr: str) -> str:
+    """
+    Encode a VCF's genotypes once and save them for reuse by later runs
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    
+    Returns
+	-------
+	index : str
+        Directory name of the index written
+    """
+
+    geno, found_chr = _parse_geno(file, chr)
+    index = _index_path(file, chr)
+    os.makedirs(index, exist_ok = True)
+    # drop any old description first: an index without one is never used
+    meta = os.path.join(index, INDEX_META)
+    if os.path.exists(meta): os.remove(meta)
+    arrays = [geno.values, geno.index.values, geno.columns.values.astype(str)]
+    for name, array in zip(INDEX_ARRAYS, arrays):
+        np.save(os.path.join(index, name + '.npy'), array)
+    with open(meta, 'w') as out:
+        json.dump(dict(version = INDEX_VERSION, chr = found_chr, 
+                       region = '' if chr is None else chr, 
+                       **_fingerprint(file)), out)
+    return index
+
+def _shared_geno(founders: pd.DataFrame, founder_chr: str, descendents: str,
+                 chr: str, samples: list[str] = None
+                 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Load descendent genotypes and keep the positions shared with founders
+
+    Parameters
+    ----------
+    founders : pd.DataFrame
+        k positions x n founders table of numeric genotypes
+    founder_chr : str
+        Chromosome the founder genotypes are from
+    descendents : str
+        VCF file with descendent genotypes
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    samples : list[str]
+        IDs of the descendents to use (None means to use all)
+    
+    Returns
+	-------
+	founders : pd.DataFrame
+        Founder genotypes at shared positions
+    desc : pd.DataFrame
+        Descendent genotypes at the same positions, in the same order
+    """
+
+    desc, desc_chr = _get_geno(descendents, chr, samples)
+
+    if desc_chr != founder_chr:
+        ERROR('Founder and descendents have different chromosomes')
+    with stage('shared_sites') as note:
+        founder_rows, desc_rows = _shared_sites(founders.index.values, 
+                                                desc.index.values)
+        _report_sites(len(founder_rows), len(founders), len(desc))
+
+        # filter down to only shared positions; skipping this when all are
+        # shared keeps memory-mapped genotypes from being copied into memory
+        if not founders.index.equals(desc.index):
+            founders = founders.iloc[founder_rows]
+            desc = desc.iloc[desc_rows]
+        note(founders = founders, descendents = desc)
+    return founders, desc
+
+def _stream_dists(founders: pd.DataFrame, founder_chr: str, descendents: str,
+                  chr: str, chunk_size: int, threads: int = 1,
+                  engine: str = DIST_ENGINES[0], 
+                  samples: list[str] = None) -> pd.DataFrame:
+    """
+    Calculate descendent v founder distances, reading descendents in chunks
+
+    Parameters
+    ----------
+    founders : pd.DataFrame
+        k positions x n founders table of numeric genotypes
+    founder_chr : str
+        Chromosome the founder genotypes are from
+    descendents : str
+        VCF file with descendent genotypes
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    chunk_size : int
+        How many VCF positions to hold in memory at once
+    threads : int
+        How many threads to split descendents across. Default 1.
+    engine : str
+        How to count mismatches (one of DIST_ENGINES, where 'pairwise' means
+        'blocked'). Default 'bitpacked'.
+    samples : list[str]
+        IDs of the descendents to use (None means to use all)
+    
+    Returns
+	-------
+	matrix : pd.DataFrame
+        n descendents x n founders matrix (labeled) of Hamming distances
+    """
+
+    # the pairwise engine computes whole distances, which cannot be summed
+    if engine == 'pairwise': engine = 'blocked'
+    samples, mismatch, valid = _stream_counts(founders, founder_chr, 
+                                              descendents, chr, chunk_size, 
+                                              threads, engine, samples)
+    return pd.DataFrame(_counts_to_dists(mismatch, valid), index = samples,
+                        columns = founders.columns)
+
+def _stream_counts(founders: pd.DataFrame, founder_chr: str, descendents: str,
+                   chr: str, chunk_size: int, threads: int = 1,
+                   engine: str = DIST_ENGINES[0], samples: list[str] = None
+                   ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count descendent v founder mismatches, reading descendents in chunks
+
+    Parameters
+    ----------
+    founders : pd.DataFrame
+        k positions x n founders table of numeric genotypes
+    founder_chr : str
+        Chromosome the founder genotypes are from
+    descendents : str
+        VCF file with descendent genotypes
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    chunk_size : int
+        How many VCF positions to hold in memory at once
+    threads : int
+        How many threads to split descendents across. Default 1.
+    engine : str
+        Either 'bitpacked' or 'blocked'. Default 'bitpacked'.
+    samples : list[str]
+        IDs of the descendents to use (None means to use all)
+    
+    Returns
+	-------
+	samples : np.ndarray
+        Descendent IDs
+    mismatch : np.ndarray
+        n descendents x n founders array of positions where both are called
+        and differ
+    valid : np.ndarray
+        n descendents x n founders array of positions where both are called
+    """
+
+    samples, chunks = _iter_vcf(descendents, chr, chunk_size, samples)
+    mismatch = np.zeros((len(samples), founders.shape[1]), dtype = np.int64)
+    valid = np.zeros_like(mismatch)
+    match = _chunk_matcher(founders.index.values)
+    informative, classes, inverse = _founder_panel(founders.values)
+    n_shared, n_desc = 0, 0
+    for chunk in _one_chr_chunks(chunks, descendents, chr):
+        if chunk['variants/CHROM'][0] != founder_chr:
+            ERROR('Founder and descendents have different chromosomes')
+        
+        # only positions also in the founders contribute to distances
+        n_desc += len(chunk['variants/POS'])
+        shared, rows = match(chunk['variants/POS'])
+        if not shared.any(): continue
+        n_shared += shared.sum()
+        # founders the same at all positions are the same at these ones too
+        chunk_mismatch, chunk_valid = _panel_counts(
+            _decode_geno(chunk)[shared], founders.values[rows], threads, 
+            engine, (informative[rows], classes, inverse))
+        mismatch += chunk_mismatch
+        valid += chunk_valid
+    
+    _report_sites(n_shared, len(founders), n_desc)
+    return samples, mismatch, valid
+
+def _chunk_matcher(pos: np.ndarray):
+    """
+    Prepare to find chunks of a VCF's positions among other positions
+
+    Parameters
+    ----------
+    pos : np.ndarray
+        Positions to look chunks up in (e.g. founder positions)
+    
+    Returns
+	-------
+	match : Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+        Given each chunk's positions in file order, returns a mask of those
+        also in pos and their indices in pos. Repeats pair up as in
+        _shared_sites, even across chunks.
+    """
+
+    # positions sorted once, to look up each chunk's positions in
+    keys = _site_keys(pos)
+    order = np.argsort(keys)
+    keys = keys[order]
+    # the last position seen, and how often, so repeats span chunks correctly
+    last_pos, last_count = None, 0
+
+    def match(chunk_pos):
+        nonlocal last_pos, last_count
+        ranks = _repeat_ranks(chunk_pos)
+        ranks[chunk_pos == last_pos] += last_count
+        last_pos, last_count = chunk_pos[-1], ranks[-1] + 1
+        chunk_keys = _site_keys(chunk_pos, ranks)
+        found = np.minimum(np.searchsorted(keys, chunk_keys), len(keys) - 1)
+        shared = keys[found] == chunk_keys
+        return shared, order[found[shared]]
+    return match
+
+def _top_k(mismatch: np.ndarray, valid: np.ndarray, 
+           k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pick out the k smallest distances in each row of a count matrix
+
+    Ties go to the earlier column, so the first pick is always the same as
+    idxmin's. Missing distances (no mutually called positions) come last.
+
+    Parameters
+    ----------
+    mismatch : np.ndarray
+        n_row x n_col array of positions where both are called and differ
+    valid : np.ndarray
+        n_row x n_col array of positions where both are called
+    k : int
+        How many columns to pick for each row. At most n_col.
+    
+    Returns
+	-------
+	best : np.ndarray
+        n_row x k column indices, closest first
+    dists : np.ndarray
+        n_row x k distances of those columns
+    sites : np.ndarray
+        n_row x k numbers of mutually called positions behind those distances
+    margin : np.ndarray
+        Difference between the second-smallest and smallest distance in each
+        row (NaN with only one column)
+    """
+
+    dists = _counts_to_dists(mismatch, valid)
+    keys = np.where(np.isnan(dists), np.inf, dists)
+    # a second pick is always made, to measure the margin with
+    n_pick = min(max(k, 2), keys.shape[1])
+    # the n_pick-th smallest value is the cutoff; partitioning finds it without
+    # sorting the rows, then ties at it are settled by column order
+    cutoff = np.partition(keys, n_pick - 1, axis = 1)[:, [n_pick - 1]]
+    below = keys < cutoff
+    at = (keys == cutoff) & (np.cumsum(keys == cutoff, axis = 1) <= 
+                             n_pick - below.sum(axis = 1, keepdims = True))
+    picked = np.nonzero(below | at)[1].reshape(len(keys), n_pick)
+    order = np.argsort(np.take_along_axis(keys, picked, axis = 1), axis = 1, 
+                       kind = 'stable')
+    picked = np.take_along_axis(picked, order, axis = 1)
+
+    picked_dists = np.take_along_axis(dists, picked, axis = 1)
+    margin = picked_dists[:, 1] - picked_dists[:, 0] if n_pick > 1 else \
+        np.full(len(keys), np.nan)
+    picked = picked[:, :k]
+    return (picked, picked_dists[:, :k], 
+            np.take_along_axis(valid, picked, axis = 1), margin)
+
+def _founder_blocks(desc: pd.DataFrame, founders: pd.DataFrame, engine: str,
+                    threads: int) -> Iterator[np.ndarray]:
+    """
+    Calculate distances to FOUNDER_BLOCK founders at a time
+
+    Work on the descendents alone (finding the panel's informative positions
+    and bit-packing calls there) is done once, not again for every block.
+
+    Parameters
+    ----------
+    desc : pd.DataFrame
+        k positions x n descendents table of numeric genotypes
+    founders : pd.DataFrame
+        k positions x n founders table of numeric genotypes
+    engine : str
+        How to compute distances (one of DIST_ENGINES)
+    threads : int
+        How many threads to split descendents across
+    
+    Returns
+	-------
+	blocks : Iterator[np.ndarray]
+        n descendents x some founders distance matrices, covering founders in
+        order
+    """
+
+    if engine not in ['bitpacked', 'blocked']:
+        for start in range(0, founders.shape[1], FOUNDER_BLOCK):
+            yield _geno_dists(desc, founders.iloc[:, start:start + 
+                                                  FOUNDER_BLOCK], 
+                              engine, threads).values
+        return
+    # positions all founders share are shared within every block too
+    informative, _, inverse = _founder_panel(founders.values)
+    packed = None
+    if engine == 'bitpacked':
+        packed = _pack_panel(desc.values, founders.values, 
+                             sites = informative)
+    for start in range(0, founders.shape[1], FOUNDER_BLOCK):
+        block = founders.values[:, start:start + FOUNDER_BLOCK]
+        # haplotype classes of the whole panel, limited to this block
+        _, classes, block_inverse = np.unique(
+            inverse[start:start + FOUNDER_BLOCK], return_index = True, 
+            return_inverse = True)
+        # founders are packed with the descendents, so take this block's
+        block_packed = None if packed is None else packed[:3] + tuple(
+            plane[:, start:start + FOUNDER_BLOCK] for plane in packed[3:])
+        with stage('geno_dists') as note:
+            dists = _counts_to_dists(*_panel_counts(
+                desc.values, block, threads, engine, 
+                (informative, classes, block_inverse.reshape(-1)), 
+                block_packed))
+            note(matrix = dists)
+        yield dists
+
+def _group_search(blocks: Iterator[np.ndarray], desc_ids: pd.Index, 
+                  founder_ids: pd.Index, groups: dict[str, str], 
+                  group_dists: str = None) -> pd.Series:
+    """
+    Find each descendent's best founder group, one block of founders at a time
+
+    Only the best founder so far and the closest member of each group are kept
+    for each descendent, so memory grows with groups rather than founders.
+
+    Parameters
+    ----------
+    blocks : Iterator[np.ndarray]
+        n descendents x some founders distance matrices, covering founder_ids
+        in order
+    desc_ids : pd.Index
+        Descendent IDs, in row order
+    founder_ids : pd.Index
+        Founder IDs, in column order
+    groups : dict[str, str]
+        Each founder ID pointing to its group's string
+    group_dists : str
+        If not None, the distance of each descendent to the closest member of
+        each group will be written to the file specified.
+    
+    Returns
+	-------
+	matches : pd.Series
+        The group best matching each descendent (descendent IDs in index)
+    """
+
+    labels = list(dict.fromkeys(groups[id] for id in founder_ids))
+    group_of = pd.Index(labels).get_indexer([groups[id] for id in founder_ids])
+    group_min = np.full((len(desc_ids), len(labels)), np.nan)
+    best = np.full(len(desc_ids), -1)
+    best_dist = np.full(len(desc_ids), np.inf)
+
+    start = 0
+    for block in blocks:
+        block_groups = group_of[start:start + block.shape[1]]
+        # closest member of each group in the block, with members side by side
+        order = np.argsort(block_groups, kind = 'stable')
+        bounds = np.flatnonzero(np.diff(block_groups[order], prepend = -1))
+        present = block_groups[order][bounds]
+        group_min[:, present] = np.fmin(
+            group_min[:, present], np.fmin.reduceat(block[:, order], bounds, 
+                                                    axis = 1))
+        # the first founder with the smallest distance wins, as with idxmin
+        block = np.where(np.isnan(block), np.inf, block)
+        local = block.argmin(axis = 1)
+        local_dist = block[np.arange(len(local)), local]
+        better = local_dist < best_dist
+        best[better] = start + local[better]
+        best_dist[better] = local_dist[better]
+        start += block.shape[1]
+
+    if group_dists is not None:
+        print_df(pd.DataFrame(group_min, index = desc_ids, columns = labels), 
+                 group_dists)
+    # descendents with no distance to any founder get no group
+    matches = [labels[group_of[i]] if i >= 0 else np.nan for i in best]
+    return pd.Series(matches, index = desc_ids)
+
+def _repeat_ranks(pos: np.ndarray) -> np.ndarray:
+    """
+    Number the repeats of each position, in order of appearance
+
+    Parameters
+    ----------
+    pos : np.ndarray
+        Positions, which may repeat (e.g. multiallelic sites split in a VCF)
+    
+    Returns
+	-------
+	ranks : np.ndarray
+        0 for the first time each position appears, 1 for the second, etc.
+    """
+
+    order = np.argsort(pos, kind = 'stable')
+    ordered = pos[order]
+    ranks = np.empty(len(pos), dtype = np.int64)
+    ranks[order] = np.arange(len(pos)) - np.searchsorted(ordered, ordered)
+    return ranks
+
+def _site_keys(pos: np.ndarray, ranks: np.ndarray = None) -> np.ndarray:
+    """
+    Make a unique key for each position, telling apart repeats of it
+
+    Parameters
+    ----------
+    pos : np.ndarray
+        Positions
+    ranks : np.ndarray
+        Which repeat of its position each is. Default _repeat_ranks(pos).
+    
+    Returns
+	-------
+	keys : np.ndarray
+        int64 keys which sort as (position, repeat) pairs
+    """
+
+    if ranks is None: ranks = _repeat_ranks(pos)
+    if len(ranks) and ranks.max() >= 1 << REPEAT_BITS:
+        ERROR('A position is repeated more than {max} times'.format(
+            max = 1 << REPEAT_BITS))
+    return (pos.astype(np.int64) << REPEAT_BITS) | ranks
+
+def _shared_sites(founder_pos: np.ndarray, 
+                  desc_pos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Line up the positions two VCFs have in common
+
+    The k-th repeat of a position in one file matches only its k-th repeat in
+    the other, so split multiallelic sites pair up in file order.
+
+    Parameters
+    ----------
+    founder_pos : np.ndarray
+        Positions in the founders VCF
+    desc_pos : np.ndarray
+        Positions in the descendents VCF
+    
+    Returns
+	-------
+	founder_rows : np.ndarray
+        Indices of shared positions in founder_pos, in position order
+    desc_rows : np.ndarray
+        Indices of the same positions in desc_pos
+    """
+
+    return np.intersect1d(_site_keys(founder_pos), _site_keys(desc_pos), 
+                          assume_unique = True, return_indices = True)[1:]
+
+def _report_sites(n_shared: int, n_founder: int, n_desc: int) -> None:
+    """
+    Log how many positions are shared between founders and descendents
+
+    Parameters
+    ----------
+    n_shared : int
+        Number of positions in both
+    n_founder : int
+        Number of founder positions
+    n_desc : int
+        Number of descendent positions
+    """
+
+    if n_shared == 0: ERROR('Founders and descendents share no positions')
+    LOG('{shared} positions shared; dropped {founder} founder-only and '
+        '{desc} descendent-only positions'.format(
+            shared = n_shared, founder = n_founder - n_shared, 
+            desc = n_desc - n_shared))
+
+def print_df(df: pd.DataFrame, out, round = True,
+             header: bool = True, mode: str = 'w', format: str = None) -> None:
+    """
+    Pretty-print a Pandas data frame
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Data to print
+    out : FilePath | WriteBuffer[str]
+        Where to write the data to
+    round : bool
+        Whether to round the data. Default True.
+    header : bool
+        Whether to print the header/column names. Default True.
+    mode: str
+        What mode to print the data in. Default 'w'.
+    format: str
+        One of OUT_FORMATS. Default from the extension of out, if a filename,
+        or else 'tsv'. Binary formats ignore round, header and mode.
+    """
+
+    with stage('print_df') as note:
+        note(table = df)
+        _print_df(df, out, round, header, mode, format)
+
+def _print_df(df: pd.DataFrame, out, round: bool, header: bool, mode: str,
+              format: str) -> None:
+    """
+    Pretty-print a Pandas data frame, as print_df does but without profiling
+    """
+
+    if format is None:
+        format = output_format(out) if isinstance(out, str) else 'tsv'
+    if format == 'npz':
+        with open(out, 'wb') as f:
+            np.savez(f, matrix = df.values.astype(np.float32), 
+                     rows = df.index.values.astype(str),
+                     columns = df.columns.values.astype(str))
+        return
+    if format == 'parquet':
+        try:
+            df.astype(np.float32).to_parquet(out)
+        except ImportError:
+            ERROR('Writing parquet files needs pyarrow or fastparquet')
+        return
+
+    # text is made a block of rows at a time, never for the whole table at once
+    opened = isinstance(out, str)
+    if opened: 
+        out = gzip.open(out, mode + 't') if format == 'tsv.gz' \
+            else open(out, mode)
+    try:
+        for start in range(0, max(len(df), 1), PRINT_ROWS):
+            block = df.iloc[start:start + PRINT_ROWS]
+            if round: block = block.round(decimals = 4)
+            block.to_csv(out, sep = '\t', header = header and start == 0)
+    finally:
+        if opened: out.close()
+
+def output_format(file: str) -> str:
+    """
+    Guess which format a table should be written in from its filename
+
+    Parameters
+    ----------
+    file : str
+        Filename to be written, or None for stdout
+    
+    Returns
+	-------
+	format : str
+        Whichever of OUT_FORMATS has the file's extension, else 'tsv'
+    """
+
+    if file is None: return 'tsv'
+    for format, extension in OUT_FORMATS.items():
+        if file.endswith(extension) and format != 'tsv': return format
+    return 'tsv'
+
+def read_matrix(file: str, format: str = None) -> pd.DataFrame:
+    """
+    Read back a labeled matrix written by print_df
+
+    Parameters
+    ----------
+    file : str
+        Filename of the matrix
+    format : str
+        One of OUT_FORMATS. Default from the extension of file.
+    
+    Returns
+	-------
+	matrix : pd.DataFrame
+        The matrix, with its row and column labels
+    """
+
+    if format is None: format = output_format(file)
+    if format == 'npz':
+        with np.load(file) as data:
+            return pd.DataFrame(data['matrix'], index = data['rows'], 
+                                columns = data['columns'])
+    if format == 'parquet':
+        try:
+            return pd.read_parquet(file)
+        except ImportError:
+            ERROR('Reading parquet files needs pyarrow or fastparquet')
+    return pd.read_csv(file, sep = '\t', index_col = 0)
+
+def read_samples(file: str) -> list[str]:
+    """
+    Read a list of sample IDs, one per line
+
+    Parameters
+    ----------
+    file : str
+        Filename; blank lines are skipped
+    
+    Returns
+	-------
+	samples : list[str]
+        Sample IDs, in file order without repeats
+    """
+
+    with open(file) as f:
+        samples = list(dict.fromkeys(line.strip() for line in f 
+                                     if line.strip()))
+    if not samples: ERROR('No sample IDs in {file}'.format(file = file))
+    return samples
+
+def _hamming_ignore_missing(x: list[int], y: list[int]) -> int:
+    """
+    Calculate Hamming distance between genotypes ignoring missing positions
+    Parameters
+    ----------
+    x : list[int]
+        One numeric genotype
+    y : list[int]
+        Another numeric genotype
+    
+    Returns
+	-------
+	dist : int
+        Hamming distance between x and y excluding positions where either is NA
+    """
+    
+    from scipy.spatial.distance import hamming
+    return hamming(x, y, np.where(np.logical_or(x == 0, y == 0), 0, 1))
+
+def _make_groups(founder_ids: set[str], groups: list[str]) -> list[list[str]]:
+    """
+    Process input groups to create final final groups
+
+    Parameters
+    ----------
+    founder_ids : set[str]
+        All founder IDs
+    groups : list[str]
+        Founders to group together. Must not be None.
+        Each list item is a group; IDs with a group are comma-separated.
+    
+    Returns
+	-------
+	groups : list[list[str]]
+        Sublists are groups and sublist items are founder IDs. 
+        All IDs are in exactly one group.
+    """
+
+    # turn input groups into a ragged array
+    groups = [group.split(',') for group in groups]
+    flat_groups = list(chain.from_iterable(groups))
+
+    if len(flat_groups) != len(set(flat_groups)):
+        ERROR('Some groups contain duplicate founder IDs')
+    if not set(flat_groups).issubset(founder_ids):
+        ERROR('Some groups contain nonexistant founder IDs')
+    
+    # make a new group for each ID which appears in no group
+    [groups.append([id]) for id in founder_ids if id not in flat_groups]
+    return groups
+
+def _geno_dists(row_geno: pd.DataFrame, col_geno: pd.DataFrame,
+                engine: str = DIST_ENGINES[0], 
+                threads: int = 1) -> pd.DataFrame:
+    """
+    Calculate pairwise distances between sample genotypes
+
+    Parameters
+    ----------
+    row_geno:
+        k positions x n_row table of genotypes for samples to be output rows
+    col_geno:
+        k positions x n_col table of genotypes for samples to be output columns
+    engine : str
+        How to compute distances (one of DIST_ENGINES). Default 'bitpacked'.
+    threads : int
+        How many threads to split row samples across. Default 1.
+    
+    Returns
+	-------
+	matrix : pd.DataFrame
+        n_row x n_col matrix (labeled) of Hamming distances between samples
+    """
+
+    with stage('geno_dists') as note:
+        if engine in ['bitpacked', 'blocked']:
+            matrix = _counts_to_dists(*_panel_counts(
+                row_geno.values, col_geno.values, threads, engine))
+        elif engine == 'pairwise':
+            from sklearn.metrics import pairwise_distances
+            # sklearn requires samples to be rows and features to be columns
+            matrix = np.concatenate(_map_row_parts(
+                lambda part: pairwise_distances(
+                    part.transpose(), col_geno.values.transpose(), 
+                    metric = _hamming_ignore_missing), 
+                row_geno.values, threads))
+        else:
+            ERROR('Unknown distance engine {engine}'.format(engine = engine))
+        note(matrix = matrix)
+    # label samples before returning the matrix
+    return pd.DataFrame(matrix, index = row_geno.columns, 
+                        columns = col_geno.columns)
+
+def _map_row_parts(func, row_geno: np.ndarray, threads: int, 
+                   *others: np.ndarray) -> list:
+    """
+    Apply a function to contiguous groups of samples, perhaps in parallel
+
+    Parameters
+    ----------
+    func : Callable[[np.ndarray], Any]
+        Function taking a k positions x n_part array of genotypes (then the
+        same part of each of others)
+    row_geno : np.ndarray
+        k positions x n_row array of genotypes to split up by sample
+    threads : int
+        How many threads (and groups of samples) to use
+    others : np.ndarray
+        Further arrays with a column per sample, split up the same way
+    
+    Returns
+	-------
+	results : list
+        func's result for each group, in sample order whatever the threading
+    """
+
+    if threads <= 1 or row_geno.shape[1] <= 1: 
+        return [func(row_geno, *others)]
+    bounds = np.linspace(0, row_geno.shape[1], 
+                         min(threads, row_geno.shape[1]) + 1).astype(int)
+    # slices (not index lists) keep memory-mapped genotypes from being copied
+    parts = [[array[:, start:end] for start, end in zip(bounds, bounds[1:])]
+             for array in (row_geno, *others)]
+    # numpy releases the GIL in its heavy loops, so threads run in parallel
+    with ThreadPoolExecutor(max_workers = threads) as pool:
+        return list(pool.map(func, *parts))
+
+def _founder_panel(geno: np.ndarray
+                   ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the positions and founders which need comparing to descendents
+
+    A position where all founders are called with the same allele adds the
+    same counts to a descendent's distance from every founder, and founders
+    with identical genotypes (haplotype classes) have identical distances.
+
+    Parameters
+    ----------
+    geno : np.ndarray
+        k positions x n founders array of genotypes
+    
+    Returns
+	-------
+	informative : np.ndarray
+        Boolean mask of positions where founders are not all called the same
+    classes : np.ndarray
+        Index of one founder of each haplotype class
+    inverse : np.ndarray
+        Which haplotype class each founder is in
+    """
+
+    informative = np.zeros(geno.shape[0], dtype = bool)
+    # founders stay in one class while they agree at every position so far,
+    # so classes can be refined a block of positions at a time
+    labels = np.zeros(geno.shape[1], dtype = np.int64)
+    block = max(1, min(BLOCK_SITES, BLOCK_CELLS // max(1, geno.shape[1])))
+    for start in range(0, geno.shape[0], block):
+        sub = geno[start:start + block]
+        kept = (sub != sub[:, [0]]).any(axis = 1) | (sub == 0).any(axis = 1)
+        informative[start:start + block] = kept
+        # numpy cannot find unique rows of objects, as used for huge codes
+        if geno.dtype.kind == 'i' and kept.any():
+            labels = np.unique(np.column_stack((labels, sub[kept].T)), 
+                               axis = 0, return_inverse = True)[1].reshape(-1)
+    if geno.dtype.kind != 'i':
+        return informative, np.arange(geno.shape[1]), np.arange(geno.shape[1])
+    _, classes, inverse = np.unique(labels, return_index = True, 
+                                    return_inverse = True)
+    return informative, classes, inverse.reshape(-1)
+
+def _panel_counts(row_geno: np.ndarray, col_geno: np.ndarray, threads: int,
+                  engine: str = DIST_ENGINES[0], 
+                  panel: Tuple[np.ndarray, np.ndarray, np.ndarray] = None,
+                  packed: tuple = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count mismatched and mutually called positions, comparing only at
+    informative positions and once per haplotype class of column samples
+
+    Parameters
+    ----------
+    row_geno : np.ndarray
+        k positions x n_row array of genotypes for samples to be output rows
+    col_geno : np.ndarray
+        k positions x n_col array of genotypes for samples to be output columns
+    threads : int
+        How many threads to split row samples across
+    engine : str
+        Either 'bitpacked' or 'blocked'. Default 'bitpacked'.
+    panel : Tuple[np.ndarray, np.ndarray, np.ndarray]
+        _founder_panel of col_geno, if already known
+    packed : tuple
+        _pack_panel of row_geno and col_geno at the panel's informative
+        positions, if already known (bitpacked engine only)
+    
+    Returns
+	-------
+	mismatch : np.ndarray
+        n_row x n_col array of positions where both are called and differ
+    valid : np.ndarray
+        n_row x n_col array of positions where both are called
+    """
+
+    informative, classes, inverse = _founder_panel(col_geno) if panel is None \
+        else panel
+    if informative.all() and len(classes) == col_geno.shape[1]:
+        return _row_parts_counts(row_geno, col_geno, threads, engine, packed)
+
+    # the kernels apply the mask and classes a block at a time, so the
+    # genotypes (perhaps memory-mapped) are never copied whole
+    if informative.any():
+        mismatch, valid = _row_parts_counts(row_geno, col_geno, threads, 
+                                            engine, packed, informative, 
+                                            classes)
+    else:
+        mismatch = np.zeros((row_geno.shape[1], len(classes)), dtype = np.int64)
+        valid = np.zeros_like(mismatch)
+    # elsewhere a row sample has the same counts against every column sample
+    fixed_mismatch = np.zeros(row_geno.shape[1], dtype = np.int64)
+    fixed_valid = np.zeros_like(fixed_mismatch)
+    block = max(1, BLOCK_CELLS // max(1, row_geno.shape[1]))
+    for start in range(0, row_geno.shape[0], block):
+        shared = ~informative[start:start + block]
+        if not shared.any(): continue
+        fixed = row_geno[start:start + block][shared]
+        called = fixed != 0
+        fixed_valid += called.sum(axis = 0)
+        first = col_geno[start:start + block, [0]][shared]
+        fixed_mismatch += (called & (fixed != first)).sum(axis = 0)
+    return (mismatch[:, inverse] + fixed_mismatch[:, None], 
+            valid[:, inverse] + fixed_valid[:, None])
+
+def _row_parts_counts(row_geno: np.ndarray, col_geno: np.ndarray, 
+                      threads: int, engine: str = DIST_ENGINES[0],
+                      packed: tuple = None, sites: np.ndarray = None, 
+                      cols: np.ndarray = None
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count mismatched and mutually called positions, splitting across threads
+
+    Parameters
+    ----------
+    row_geno : np.ndarray
+        k positions x n_row array of genotypes for samples to be output rows
+    col_geno : np.ndarray
+        k positions x n_col array of genotypes for samples to be output columns
+    threads : int
+        How many threads to split row samples across
+    engine : str
+        Either 'bitpacked' or 'blocked'. Default 'bitpacked'.
+    packed : tuple
+        _pack_panel of row_geno and col_geno at sites, if already known 
+        (bitpacked engine only)
+    sites : np.ndarray
+        Boolean mask of the positions to compare (None means all)
+    cols : np.ndarray
+        Index of the column samples to compare (None means all)
+    
+    Returns
+	-------
+	mismatch : np.ndarray
+        n_row x n_col array of positions where both are called and differ
+    valid : np.ndarray
+        n_row x n_col array of positions where both are called
+    """
+
+    # threads share one budget for their temporary arrays
+    cells = max(1, BLOCK_CELLS // max(1, min(threads, row_geno.shape[1])))
+    if engine == 'bitpacked' and packed is None:
+        packed = _pack_panel(row_geno, col_geno, sites = sites)
+    if engine == 'bitpacked' and packed is not None:
+        # packed rows have a column per row sample, so split alongside it
+        multi, col_planes = packed[0], packed[3:]
+        parts = _map_row_parts(
+            lambda part, alt, called: _bitpacked_counts(
+                part, col_geno, (multi, alt, called) + col_planes, cells, 
+                cols = cols), 
+            row_geno, threads, *packed[1:3])
+    else:
+        # codes too big for any integer type are left to the general engine
+        parts = _map_row_parts(
+            lambda part: _hamming_counts(part, col_geno, cells = cells, 
+                                         sites = sites, cols = cols), 
+            row_geno, threads)
+    return tuple(np.concatenate(counts) for counts in zip(*parts))
+
+def _hamming_counts(row_geno: np.ndarray, col_geno: np.ndarray,
+                    block: int = BLOCK_SITES, cells: int = BLOCK_CELLS,
+                    sites: np.ndarray = None, cols: np.ndarray = None
+                    ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count mismatched and mutually non-missing positions between samples
+
+    Parameters
+    ----------
+    row_geno : np.ndarray
+        k positions x n_row array of genotypes for samples to be output rows
+    col_geno : np.ndarray
+        k positions x n_col array of genotypes for samples to be output columns
+    block : int
+        How many positions to process at once. Default BLOCK_SITES.
+    cells : int
+        Rough cap on the size of each block's arrays. Default BLOCK_CELLS.
+    sites : np.ndarray
+        Boolean mask of the positions to compare (None means all)
+    cols : np.ndarray
+        Index of the column samples to compare (None means all)
+    
+    Returns
+	-------
+	mismatch : np.ndarray
+        n_row x n_col array of positions where both are called and differ
+    valid : np.ndarray
+        n_row x n_col array of positions where both are called
+    """
+
+    n_row = row_geno.shape[1]
+    n_col = col_geno.shape[1] if cols is None else len(cols)
+    mismatch = np.zeros((n_row, n_col), dtype = np.int64)
+    valid = np.zeros_like(mismatch)
+    # fewer positions per block for many samples, to bound one-hot memory
+    block = max(1, min(block, cells // max(1, n_row + n_col)))
+    for start in range(0, row_geno.shape[0], block):
+        row_block = row_geno[start:start + block]
+        col_block = col_geno[start:start + block]
+        # masks apply a block at a time, so inputs are never copied whole
+        if sites is not None:
+            kept = sites[start:start + block]
+            if not kept.any(): continue
+            row_block, col_block = row_block[kept], col_block[kept]
+        if cols is not None: col_block = col_block[:, cols]
+        # both sides must share one encoding so equal alleles share a column
+        row_hot, col_hot = np.split(
+            _one_hot(np.concatenate((row_block, col_block), axis = 1)), [n_row])
+        block_valid = (row_block != 0).astype(np.float32).T @ \
+            (col_block != 0).astype(np.float32)
+        # counts are small integers, which float matrix products keep exact
+        valid += block_valid.astype(np.int64)
+        mismatch += (block_valid - row_hot @ col_hot.T).astype(np.int64)
+    return mismatch, valid
+
+def _bitpacked_counts(row_geno: np.ndarray, col_geno: np.ndarray,
+                      packed: tuple = None, cells: int = BLOCK_CELLS,
+                      sites: np.ndarray = None, cols: np.ndarray = None
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count mismatched and mutually non-missing positions using bit operations
+
+    Positions with at most two called alleles are packed into bits (one plane
+    for which allele, one for being called) and compared with XOR/AND and
+    popcount, a word of 64 positions at a time. Positions with more alleles
+    are counted by _hamming_counts.
+
+    Parameters
+    ----------
+    row_geno : np.ndarray
+        k positions x n_row array of genotypes for samples to be output rows
+    col_geno : np.ndarray
+        k positions x n_col array of genotypes for samples to be output columns
+    packed : tuple
+        _pack_panel of row_geno and col_geno at sites, if already known
+    cells : int
+        Rough cap on the size of temporary arrays. Default BLOCK_CELLS.
+    sites : np.ndarray
+        Boolean mask of the positions to compare (None means all)
+    cols : np.ndarray
+        Index of the column samples to compare (None means all)
+    
+    Returns
+	-------
+	mismatch : np.ndarray
+        n_row x n_col array of positions where both are called and differ
+    valid : np.ndarray
+        n_row x n_col array of positions where both are called
+    """
+
+    if packed is None: packed = _pack_panel(row_geno, col_geno, cells, sites)
+    # codes too big for any integer type are left to the general engine
+    if packed is None: 
+        return _hamming_counts(row_geno, col_geno, cells = cells, 
+                               sites = sites, cols = cols)
+    multi, row_alt, row_called, col_alt, col_called = packed
+    if cols is not None: col_alt, col_called = col_alt[:, cols], \
+        col_called[:, cols]
+    mismatch, valid = _hamming_counts(row_geno, col_geno, cells = cells, 
+                                      sites = multi, cols = cols)
+    # counts build up a word at a time in reused buffers of some row samples
+    # against all column samples, never in rows x columns x words arrays
+    block = max(1, min(row_geno.shape[1], cells // max(1, col_alt.shape[1])))
+    both = np.empty((block, col_alt.shape[1]), dtype = np.uint64)
+    diff = np.empty_like(both)
+    for start in range(0, row_geno.shape[1], block):
+        rows = slice(start, start + block)
+        n = min(block, row_geno.shape[1] - start)
+        for word in range(row_alt.shape[0]):
+            np.bitwise_and(row_called[word, rows, None], col_called[word], 
+                           out = both[:n])
+            np.bitwise_xor(row_alt[word, rows, None], col_alt[word], 
+                           out = diff[:n])
+            diff[:n] &= both[:n]
+            valid[rows] += _popcount(both[:n])
+            mismatch[rows] += _popcount(diff[:n])
+    return mismatch, valid
+
+def _pack_panel(row_geno: np.ndarray, col_geno: np.ndarray, 
+                cells: int = BLOCK_CELLS, sites: np.ndarray = None) -> tuple:
+    """
+    Bit-pack row and column samples, a block of positions at a time
+
+    Each block is read once and written into preallocated bit planes, so
+    memory-mapped genotypes are never loaded whole.
+
+    Parameters
+    ----------
+    row_geno : np.ndarray
+        k positions x n_row array of genotypes for samples to be output rows
+    col_geno : np.ndarray
+        k positions x n_col array of genotypes for samples to be output columns
+    cells : int
+        Rough cap on the size of each block's arrays. Default BLOCK_CELLS.
+    sites : np.ndarray
+        Boolean mask of the positions to pack (None means all)
+    
+    Returns
+	-------
+	packed : tuple
+        Boolean mask of positions (among sites) with more than two called
+        alleles, left out of the planes, then which-allele and called bit 
+        planes of the row samples and of the column samples (words x n uint64
+        arrays). None if codes are too big for any integer type.
+    """
+
+    dtype = np.result_type(row_geno, col_geno)
+    if dtype.kind != 'i': return None
+    lowest, highest = dtype.type(np.iinfo(dtype).min), \
+        dtype.type(np.iinfo(dtype).max)
+    n_sites, n_row, n_col = row_geno.shape[0], row_geno.shape[1], \
+        col_geno.shape[1]
+    # each block packs into whole words of its own
+    block = max(64, min(BLOCK_SITES, cells // max(1, n_row + n_col)) // 64 * 64)
+    starts = range(0, n_sites, block)
+    sizes = [min(block, n_sites - start) if sites is None 
+             else int(sites[start:start + block].sum()) for start in starts]
+    words = np.cumsum([0] + [(size + 63) // 64 for size in sizes])
+    planes = [np.zeros((words[-1], n), dtype = np.uint64) 
+              for n in [n_row, n_row, n_col, n_col]]
+    multi = np.zeros(n_sites, dtype = bool)
+    for start, size, first, last in zip(starts, sizes, words, words[1:]):
+        if size == 0: continue
+        blocks = [row_geno[start:start + block], col_geno[start:start + block]]
+        if sites is not None:
+            kept = sites[start:start + block]
+            blocks = [geno[kept] for geno in blocks]
+        # at a biallelic position every called allele is the lowest or highest
+        high = np.max([np.where(geno != 0, geno, lowest).max(
+            axis = 1, initial = lowest) for geno in blocks], axis = 0)
+        low = np.min([np.where(geno != 0, geno, highest).min(
+            axis = 1, initial = highest) for geno in blocks], axis = 0)
+        biallelic = np.logical_and.reduce(
+            [((geno == high[:, None]) | (geno == low[:, None]) | 
+              (geno == 0)).all(axis = 1) for geno in blocks])
+        if sites is None: multi[start:start + block] = ~biallelic
+        else: multi[start:start + block][kept] = ~biallelic
+        for geno, alt, called in zip(blocks, planes[::2], planes[1::2]):
+            is_called = (geno != 0) & biallelic[:, None]
+            called[first:last] = _pack_bits(is_called.T).T
+            alt[first:last] = _pack_bits((is_called & 
+                                          (geno == high[:, None])).T).T
+    return (multi,) + tuple(planes)
+
+def _pack_bits(bits: np.ndarray) -> np.ndarray:
+    """
+    Pack rows of booleans into 64-bit words
+
+    Parameters
+    ----------
+    bits : np.ndarray
+        n x k boolean array
+    
+    Returns
+	-------
+	words : np.ndarray
+        n x ceil(k / 64) uint64 array (padded with zero bits)
+    """
+
+    packed = np.packbits(bits, axis = 1)
+    # pad out to whole words so each row can be viewed as uint64s
+    packed = np.pad(packed, ((0, 0), (0, -packed.shape[1] % 8)))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    """
+    Count set bits in each element of an unsigned integer array
+
+    Parameters
+    ----------
+    words : np.ndarray
+        uint64 array
+    
+    Returns
+	-------
+	counts : np.ndarray
+        Number of set bits in each element
+    """
+
+    if hasattr(np, 'bitwise_count'): return np.bitwise_count(words)
+    # older numpy has no popcount ufunc, so count bytes with a lookup table
+    table = np.array([bin(i).count('1') for i in range(256)], dtype = np.uint8)
+    return table[words.view(np.uint8)].reshape(words.shape + (8,)).sum(
+        axis = -1, dtype = np.uint8)
+
+def _one_hot(geno: np.ndarray) -> np.ndarray:
+    """
+    One-hot encode called alleles at each position
+
+    Parameters
+    ----------
+    geno : np.ndarray
+        k positions x n samples array of numeric genotypes
+    
+    Returns
+	-------
+	hot : np.ndarray
+        n samples x m array, with one column per distinct allele at each 
+        position, which is 1 where that sample has that allele called
+    """
+
+    # dense allele IDs, then one ID per distinct (position, allele) pair
+    alleles = np.unique(geno.ravel(), return_inverse = True)[1]
+    alleles = alleles.reshape(geno.shape)
+    pairs = np.arange(geno.shape[0])[:, None] * (alleles.max() + 1) + alleles
+    pairs = np.unique(pairs.ravel(), return_inverse = True)[1]
+    hot = np.zeros((geno.shape[1], pairs.max() + 1), dtype = np.float32)
+    # missing genotypes have their own (never set) column at each position
+    hot[np.tile(np.arange(geno.shape[1]), geno.shape[0]), pairs] = \
+        geno.ravel() != 0
+    return hot
+
+def _counts_to_dists(mismatch: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Turn mismatch and mutually-called counts into missing-aware Hamming
+
+    Parameters
+    ----------
+    mismatch : np.ndarray
+        Number of positions where both samples are called and differ
+    valid : np.ndarray
+        Number of positions where both samples are called
+    
+    Returns
+	-------
+	dists : np.ndarray
+        Fraction of mutually-called positions which differ (NaN if none)
+    """
+
+    return np.divide(mismatch, valid, out = np.full(valid.shape, np.nan),
+                     where = valid > 0)
+
+def _merge_matrix_groups(matrix: pd.DataFrame, 
+                         groups: list[list[str]]) -> pd.DataFrame:
+    """
+    Merge groups in a distance matrix by averaging distance between members
+
+    Parameters
+    ----------
+    matrix : pd.DataFrame
+        n x n matrix (labeled) of Hamming distances between founders
+    groups : list[list[str]]
+        Sublists are groups and sublist items are founder IDs. Must not be None.
+        All IDs are in exactly one group.
+    
+    Returns
+	-------
+	merged : pd.DataFrame
+        n groups x n groups matrix (labeled) of Hamming distances between groups
+    """
+
+    # founders x groups membership matrix, so that group sums are G^T D G
+    labels = [','.join(group) for group in groups]
+    members = np.zeros((len(matrix), len(groups)))
+    rows = matrix.index.get_indexer([id for group in groups for id in group])
+    members[rows, np.repeat(np.arange(len(groups)), 
+                            [len(group) for group in groups])] = 1
+    # columns are ordered as rows, so the same membership matrix serves both
+    dists = matrix.loc[:, matrix.index].to_numpy(dtype = np.float64)
+
+    # average over member pairs with a distance, as missing ones are skipped
+    valid = ~np.isnan(dists)
+    sums = members.T @ np.where(valid, dists, 0) @ members
+    counts = members.T @ valid @ members
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        merged = sums / counts
+    merged[counts == 0] = np.nan
+    # main diagonal is set to 0 and not average in-group distance
+    np.fill_diagonal(merged, 0)
+    return pd.DataFrame(merged, index = labels, columns = labels)
+
+def _to_code(geno: str) -> int:
+    """
+    Convert a genotype to a number
+
+    Parameters
+    ----------
+    geno: str
+        An allele's genotype (from a VCF file, REF or ALT columns)
+    
+    Returns
+	-------
+	code : int
+        A numeric code corresponding to this genotype
+    """
+        
+    # missingness due to an upstream deletion
+    if geno == '*': return -1
+    # build up numeric code for allele as if ACGT is 1234 in base-5
+    code = 0
+    for base in geno:
+        if base not in BASES:
+            ERROR('Invalid base {base} in REF or ALT'.format(base = base))
+        code = code * 5 + BASES[base]
+    return code
+
+def _get_geno(file: str, chr: str, 
+              samples: list[str] = None) -> Tuple[pd.DataFrame, str]:
+    """
+    Extract unambiguous numeric genotypes from a VCF file (or its index)
 
     Parameters
     ----------
     file : str
         VCF filename
     chr : str
-        Chromosome to use from the VCF file (None means to use all)
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    samples : list[str]
+        IDs of the samples to use (None means to use all)
     
     Returns
 	-------
@@ -321,28 +2289,453 @@ def _get_geno(file: str, chr: str) -> Tuple[pd.DataFrame, str]:
         Chromosome used from VCF file
     """
 
-    try: vcf = allel.read_vcf(file, region = chr)
-    except RuntimeError:
-        ERROR("Unable to read VCF file {file}".format(file = file))
-    if vcf is None:
+    with stage('get_geno') as note:
+        found = _cached_geno(file, chr, samples)
+        if found is None: found = _load_index(file, chr, samples)
+        if found is None: found = _parse_geno(file, chr, samples)
+        note(geno = found[0])
+    return found
+
+def _cached_geno(file: str, chr: str, 
+                 samples: list[str] = None) -> Tuple[pd.DataFrame, str]:
+    """
+    Look up genotypes already split by chromosome by read_chroms
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome to use from the VCF file
+    samples : list[str]
+        IDs of the samples to use (None means to use all)
+    
+    Returns
+	-------
+	geno : pd.DataFrame
+        k positions x n samples table of numeric genotypes, or None if file
+        was not read by read_chroms
+    chr : str
+        Chromosome used from VCF file
+    """
+
+    if file not in _CHROM_GENO: return None
+    if chr not in _CHROM_GENO[file]:
         ERROR("No variants in {file} on {chr}".format(file = file, chr = chr))
+    geno = _CHROM_GENO[file][chr]
+    if samples is not None: 
+        geno = geno.iloc[:, _sample_columns(geno.columns.values, samples, file)]
+    return geno, chr
+
+def _split_geno(file: str, chrs: list[str], 
+                samples: list[str] = None) -> dict[str, pd.DataFrame]:
+    """
+    Extract numeric genotypes for several chromosomes, reading a VCF once
+
+    Chromosomes with an up-to-date index are loaded from it. If the VCF has a
+    tabix or CSI index, each other chromosome is read through it on its own;
+    otherwise the VCF is parsed once, and only the chromosomes asked for are
+    decoded.
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chrs : list[str]
+        Chromosomes to keep (None means to keep all)
+    samples : list[str]
+        IDs of the samples to use (None means to use all)
+    
+    Returns
+	-------
+	geno : dict[str, pd.DataFrame]
+        Each chromosome found (in file order when chrs is None) pointing to
+        its k positions x n samples table of numeric genotypes
+    """
+
+    split = {}
+    rest = chrs
+    if chrs is not None:
+        # up-to-date indexes spare reading the VCF for their chromosomes, and
+        # a tabix index lets each other chromosome be read on its own
+        rest = []
+        for chr in chrs:
+            found = _load_index(file, chr, samples)
+            if found is None and tabix.find_index(file) is not None:
+                found = _parse_geno(file, chr, samples)
+            if found is None: rest.append(chr)
+            else: split[chr] = found[0]
+        if not rest: return split
+
+    vcf = _read_vcf(file, None, samples)
+    found = vcf['variants/CHROM']
+    if rest is not None:
+        # only positions on chromosomes still needed are decoded
+        keep = np.isin(found, rest)
+        if not keep.any(): return split
+        vcf = {field : values[keep] if field.startswith(('variants/', 
+                                                          'calldata/')) 
+               else values for field, values in vcf.items()}
+        found = found[keep]
+    geno = _decode_geno(vcf)
+    for chr in pd.unique(found):
+        rows = found == chr
+        split[chr] = pd.DataFrame(geno[rows], columns = vcf['samples'], 
+                                  index = vcf['variants/POS'][rows])
+    return split
+
+def _parse_geno(file: str, chr: str, 
+                samples: list[str] = None) -> Tuple[pd.DataFrame, str]:
+    """
+    Extract unambiguous numeric genotypes by parsing a VCF file
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    samples : list[str]
+        IDs of the samples to use (None means to use all)
+    
+    Returns
+	-------
+	geno : pd.DataFrame
+        k positions x n samples table of numeric genotypes
+    chr : str
+        Chromosome used from VCF file
+    """
+
+    vcf = _read_vcf(file, chr, samples)
     if len(np.unique(vcf['variants/CHROM'])) > 1:
         ERROR('More than one chromosome detected in VCF file. ' \
               'Must specify one chromosome to use.')
 
-    # load and encode all alleles for each position into a ragged array
-    alleles = np.concatenate((vcf['variants/REF'][:, None], 
-                              vcf['variants/ALT']), axis = 1)
-    alleles = [[_to_code(geno) for geno in row] for row in alleles]
+    return (pd.DataFrame(_decode_geno(vcf), columns = vcf['samples'], 
+                         index = vcf['variants/POS']), vcf['variants/CHROM'][0])
+
+def _read_vcf(file: str, chr: str, samples: list[str] = None) -> dict:
+    """
+    Parse the fields INCH uses from a VCF file
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    samples : list[str]
+        IDs of the samples to parse genotypes of (None means all); the others'
+        genotype columns are skipped
+    
+    Returns
+	-------
+	vcf : dict
+        Parsed VCF_FIELDS, with as many ALT columns as some position uses
+    """
+
+    _check_samples(file, samples)
+    alt_number = ALT_NUMBER
+    with stage('read_vcf') as note:
+        while True:
+            try: 
+                vcf = allel.read_vcf(_vcf_input(file, chr), region = chr, 
+                                     fields = VCF_FIELDS, types = VCF_TYPES, 
+                                     alt_number = alt_number, 
+                                     samples = samples)
+            except RuntimeError:
+                ERROR("Unable to read VCF file {file}".format(file = file))
+            if vcf is None:
+                ERROR("No variants in {file} on {chr}".format(file = file, 
+                                                              chr = chr))
+            # re-read if some position's ALT alleles did not all fit
+            needed = vcf['variants/numalt'].max()
+            if needed <= alt_number: break
+            alt_number = needed
+        note(genotypes = vcf['calldata/GT'])
+    # only keep as many ALT columns as some position actually uses
+    vcf['variants/ALT'] = vcf['variants/ALT'][:, :needed]
+    return vcf
+
+def _iter_vcf(file: str, chr: str, chunk_size: int, 
+              samples: list[str] = None) -> Tuple[np.ndarray, Iterator[dict]]:
+    """
+    Read a VCF file a chunk of positions at a time
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    chunk_size : int
+        How many positions to read at once
+    samples : list[str]
+        IDs of the samples to parse genotypes of (None means all); the others'
+        genotype columns are skipped
+    
+    Returns
+	-------
+	samples : np.ndarray
+        IDs of the samples read from the VCF
+    chunks : Iterator[dict]
+        Parsed VCF fields (VCF_FIELDS except samples) for each chunk
+    """
+
+    def open_chunks(alt_number):
+        try: 
+            # sample IDs always come back from the header here
+            return allel.iter_vcf_chunks(_vcf_input(file, chr), region = chr, 
+                                         fields = VCF_FIELDS[1:], 
+                                         types = VCF_TYPES, 
+                                         alt_number = alt_number, 
+                                         chunk_length = chunk_size,
+                                         samples = samples)
+        except RuntimeError:
+            ERROR("Unable to read VCF file {file}".format(file = file))
+
+    def read_chunks(chunks, alt_number):
+        # how many positions have been handed out, in case of starting over
+        done = 0
+        while True:
+            seen = 0
+            try:
+                for chunk, length, _, _ in chunks:
+                    seen += length
+                    if seen <= done: continue
+                    needed = chunk['variants/numalt'].max()
+                    if needed > alt_number: break
+                    chunk['variants/ALT'] = chunk['variants/ALT'][:, :needed]
+                    done = seen
+                    yield chunk
+                else: return
+            except RuntimeError:
+                ERROR("Unable to read VCF file {file}".format(file = file))
+            # some ALT alleles did not fit: read again, skipping what was done
+            alt_number = needed
+            chunks = open_chunks(alt_number)[3]
+
+    _check_samples(file, samples)
+    _, found, _, chunks = open_chunks(ALT_NUMBER)
+    return found, read_chunks(chunks, ALT_NUMBER)
+
+def _check_samples(file: str, samples: list[str]) -> None:
+    """
+    Die unless a VCF has every sample asked for
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    samples : list[str]
+        Sample IDs, or None for all
+    """
+
+    if samples is None: return
+    try:
+        found = allel.read_vcf_headers(file).samples
+    except (OSError, RuntimeError):
+        ERROR("Unable to read VCF file {file}".format(file = file))
+    _sample_columns(np.array(found), samples, file)
+
+def _sample_columns(found: np.ndarray, samples: list[str], 
+                    file: str) -> np.ndarray:
+    """
+    Find the columns of chosen samples, dying if any are missing
+
+    Parameters
+    ----------
+    found : np.ndarray
+        Sample IDs in a VCF, in order
+    samples : list[str]
+        Sample IDs to use
+    file : str
+        VCF filename, for errors
+    
+    Returns
+	-------
+	columns : np.ndarray
+        Indices of the chosen samples, in VCF order
+    """
+
+    found = np.asarray(found).astype(str)
+    known = set(found)
+    missing = [id for id in dict.fromkeys(samples) if id not in known]
+    if missing:
+        ERROR('Samples not in {file}: {ids}'.format(
+            file = file, ids = ', '.join(missing)))
+    return np.flatnonzero(np.isin(found, list(samples)))
+
+def _vcf_input(file: str, chr: str):
+    """
+    Choose what scikit-allel should read for a region of a VCF file
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome or region to use from the VCF file (None means to use all)
+    
+    Returns
+	-------
+	input : str | io.BufferedReader
+        The file itself or, if it is indexed, a stream of just its header and
+        the part holding the region (which must still be filtered to it)
+    """
+
+    stream = None if chr is None else tabix.open_region(file, chr)
+    return file if stream is None else stream
+
+def _index_path(file: str, chr: str) -> str:
+    """
+    Name the index file holding pre-encoded genotypes for a VCF
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome used from the VCF file (None means all were used)
+    
+    Returns
+	-------
+	index : str
+        Index filename, next to the VCF
+    """
+
+    return file + ('' if chr is None else '.' + chr) + INDEX_SUFFIX
+
+def _fingerprint(file: str, content: bool = True) -> dict:
+    """
+    Summarize a file so later changes to it can be detected
+
+    Parameters
+    ----------
+    file : str
+        Filename
+    content : bool
+        Whether to also hash the file contents. Default True.
+    
+    Returns
+	-------
+	fingerprint : dict
+        File size, modification time and (if requested) SHA-256 digest
+    """
+
+    stat = os.stat(file)
+    fingerprint = {'size' : stat.st_size, 'mtime' : stat.st_mtime_ns}
+    if content:
+        sha = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''): sha.update(block)
+        fingerprint['sha256'] = sha.hexdigest()
+    return fingerprint
+
+def _load_index(file: str, chr: str, 
+                samples: list[str] = None) -> Tuple[pd.DataFrame, str]:
+    """
+    Load pre-encoded genotypes for a VCF, if an up-to-date index exists
+
+    Parameters
+    ----------
+    file : str
+        VCF filename
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF file (None 
+        means to use all)
+    samples : list[str]
+        IDs of the samples to use (None means all). Only their columns are
+        read from the index.
+    
+    Returns
+	-------
+	indexed : Tuple[pd.DataFrame, str]
+        The same as _get_geno would parse from the VCF, or None if there is no
+        usable index. Genotypes are memory-mapped (read-only) from disk.
+    """
+
+    # prefer an index of just this chromosome; dict keeps order but dedupes
+    for index in dict.fromkeys([_index_path(file, chr), 
+                                _index_path(file, None)]):
+        meta = os.path.join(index, INDEX_META)
+        if not os.path.exists(meta): continue
+        with open(meta) as f: saved = json.load(f)
+        if saved['version'] != INDEX_VERSION: continue
+        # an index of a whole single-chromosome file serves that chromosome
+        if saved['region'] != ('' if chr is None else chr) and \
+            (saved['region'] != '' or saved['chr'] != chr): continue
+        # cheap checks first; a touched but unchanged file is still fine
+        current = _fingerprint(file, content = False)
+        if saved['size'] != current['size']: continue
+        if saved['mtime'] != current['mtime'] and \
+            saved['sha256'] != _fingerprint(file)['sha256']: continue
+        geno, pos, found = [
+            np.load(os.path.join(index, name + '.npy'), mmap_mode = 'r')
+            for name in INDEX_ARRAYS]
+        if samples is not None:
+            columns = _sample_columns(found, samples, file)
+            geno, found = geno[:, columns], found[columns]
+        # wrap rather than copy, so positions are only paged in when used
+        return (pd.DataFrame(geno, columns = found, index = pos, 
+                             copy = False), saved['chr'])
+    return None
+
+def _decode_geno(vcf: dict) -> np.ndarray:
+    """
+    Turn VCF genotype calls into numeric genotypes
+
+    Parameters
+    ----------
+    vcf : dict
+        Parsed VCF data (or one chunk of it) from scikit-allel, with REF, ALT
+        and GT fields
+    
+    Returns
+	-------
+	geno : np.ndarray
+        k positions x n samples array of numeric genotypes (0 is missing)
+    """
+
+    with stage('decode_geno') as note:
+        # encode each distinct allele once, then lay codes out per position
+        alleles = np.concatenate((vcf['variants/REF'][:, None], 
+                                  vcf['variants/ALT']), axis = 1)
+        distinct, allele_idx = np.unique(alleles, return_inverse = True)
+        codes = np.array([_to_code(geno) for geno in distinct])
+        codes = codes[allele_idx.reshape(alleles.shape)]
 
-    def get_geno_code(row, geno):     
         # unknown (.) have sample-unique codes; no matching on missingness
-        return [0 if geno[i] == -1 else alleles[row][geno[i]] 
-                for i in range(len(geno))]
+        orig_gt = vcf['calldata/GT'][:, :, 0]
+        geno = codes[np.arange(codes.shape[0])[:, None], 
+                     np.maximum(orig_gt, 0)]
+        geno[orig_gt < 0] = 0
+        geno = _compact_int(geno)
+        note(geno = geno)
+    return geno
 
-    orig_gt = vcf['calldata/GT']
-    processed_gt = [get_geno_code(row, orig_gt[row][:, 0]) 
-                    for row in range(orig_gt.shape[0])]
+def _compact_int(values: np.ndarray) -> np.ndarray:
+    """
+    Store integers in the smallest signed type able to hold them
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Integer array
+    
+    Returns
+	-------
+	values : np.ndarray
+        The same values, with the narrowest of int8, int16, int32 or int64
+    """
 
-    return (pd.DataFrame(processed_gt, columns = vcf['samples'], 
-                         index = vcf['variants/POS']), vcf['variants/CHROM'][0])
\ No newline at end of file
+    # huge multi-base allele codes may not fit in any fixed-width type at all
+    if values.dtype.kind != 'i' or values.size == 0: return values
+    low, high = values.min(), values.max()
+    for dtype in [np.int8, np.int16, np.int32, np.int64]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return values.astype(dtype, copy = False)
+    return values
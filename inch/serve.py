@@ -0,0 +1,185 @@
+"""
+Long-running server matching descendents to a founder panel kept in memory
+
+Clients connect over a Unix socket or local TCP port and send one JSON request
+per line, either {"vcf": PATH} naming a descendent VCF the server can read or
+{"text": VCF} holding the VCF itself. An optional "id" is echoed back. Each
+request is answered with one JSON line: {"matches": {DESCENDENT: FOUNDER, ...}}
+or {"error": MESSAGE}.
+"""
+
+# basic utilities
+from typing import Tuple
+import asyncio
+import json
+import os
+import tempfile
+# matching itself is done by the usual helpers
+from inch import myutils
+
+# largest request line accepted, so whole VCFs can be sent as text
+MAX_LINE = 1 << 30
+
+def serve(founders: str, chr: str, groups: list[str], socket: str = None,
+          host: str = '127.0.0.1', port: int = None, jobs: int = 1,
+          chunk_size: int = None, threads: int = 1) -> None:
+    """
+    Load founders once, then answer requests until interrupted
+
+    Parameters
+    ----------
+    founders : str
+        VCF file with founder genotypes
+    chr : str
+        Chromosome (or CHR:START-END region) to use from the VCF files (None
+        means to use all)
+    groups : list[str]
+        Founders to group together during final assignment.
+        Each list item is a group; IDs with a group are comma-separated.
+    socket : str
+        Path of a Unix socket to listen on. Exactly one of socket and port
+        must be given.
+    host : str
+        Address to listen on with port. Default 127.0.0.1.
+    port : int
+        TCP port to listen on
+    jobs : int
+        How many requests to work on at once. Default 1.
+    chunk_size : int
+        If not None, stream descendents from their VCFs this many positions at
+        a time rather than loading them all at once.
+    threads : int
+        How many threads each job splits descendents across. Default 1.
+    """
+
+    async def run(pool):
+        server = await start(pool, socket, host, port)
+        myutils.LOG('Listening on {where}'.format(
+            where = socket if socket is not None else
+            '{host}:{port}'.format(host = host, port = port)))
+        async with server: await server.serve_forever()
+
+    with myutils.founder_pool(founders, chr, groups, jobs,
+                              chunk_size = chunk_size,
+                              threads = threads) as pool:
+        try:
+            asyncio.run(run(pool))
+        except KeyboardInterrupt: pass
+        finally:
+            if socket is not None and os.path.exists(socket):
+                os.remove(socket)
+
+async def start(pool, socket: str = None, host: str = '127.0.0.1',
+                port: int = None) -> asyncio.AbstractServer:
+    """
+    Start answering requests with the workers of a founder pool
+
+    Parameters
+    ----------
+    pool : Executor
+        Workers from myutils.founder_pool
+    socket : str
+        Path of a Unix socket to listen on, if not None
+    host : str
+        Address to listen on with port. Default 127.0.0.1.
+    port : int
+        TCP port to listen on, if socket is None
+
+    Returns
+	-------
+	server : asyncio.AbstractServer
+        The listening server
+    """
+
+    async def handle(reader, writer):
+        # requests on one connection are answered in order; connections are
+        # answered concurrently, as far as the pool has workers
+        try:
+            while line := await reader.readline():
+                response = await _respond(pool, line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    if socket is not None:
+        return await asyncio.start_unix_server(handle, socket, limit = MAX_LINE)
+    return await asyncio.start_server(handle, host, port, limit = MAX_LINE)
+
+async def _respond(pool, line: bytes) -> dict:
+    """
+    Answer one request line
+
+    Parameters
+    ----------
+    pool : Executor
+        Workers from myutils.founder_pool
+    line : bytes
+        JSON request
+
+    Returns
+	-------
+	response : dict
+        Matches for the request's descendents, or an error
+    """
+
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict): raise ValueError
+    except ValueError:
+        return {'error': 'Requests must be JSON objects'}
+    response = {} if 'id' not in request else {'id': request['id']}
+    if ('vcf' in request) == ('text' in request):
+        response['error'] = 'Requests need exactly one of "vcf" and "text"'
+        return response
+    field = 'vcf' if 'vcf' in request else 'text'
+    if not isinstance(request[field], str):
+        response['error'] = '"{field}" must be a string'.format(field = field)
+        return response
+
+    # one bad request must not drop the connection, or those sent after it
+    try:
+        loop = asyncio.get_running_loop()
+        if field == 'vcf':
+            matches, error = await loop.run_in_executor(pool, _identify,
+                                                        request['vcf'])
+        else:
+            # the workers read VCFs from files, so sent text is saved to one
+            with tempfile.NamedTemporaryFile('w', suffix = '.vcf') as vcf:
+                vcf.write(request['text'])
+                vcf.flush()
+                matches, error = await loop.run_in_executor(pool, _identify,
+                                                            vcf.name)
+    except Exception as e:
+        matches, error = None, str(e)
+    if error is None: response['matches'] = matches
+    else: response['error'] = error
+    return response
+
+def _identify(vcf: str) -> Tuple[dict, str]:
+    """
+    Match the descendents in a VCF, catching errors rather than dying
+
+    Parameters
+    ----------
+    vcf : str
+        VCF file with descendent genotypes
+
+    Returns
+	-------
+	matches : dict
+        Each descendent ID pointing to its best founder, or None on error
+    error : str
+        Why matching failed, or None
+    """
+
+    if not os.path.exists(vcf):
+        return None, '{vcf} does not exist'.format(vcf = vcf)
+    # errors come back with the answer: stderr is shared by all requests
+    try:
+        matches = myutils.batch_identify(vcf)
+    except SystemExit as e:
+        return None, getattr(e, 'msg', 'Matching stopped')
+    except Exception as e:
+        return None, str(e)
+    return {str(id): str(match) for id, match in matches.items()}, None
@@ -0,0 +1,156 @@
+"""
+Persistent store of descendent matches, so unchanged samples are not rescored
+
+Matches are kept in a SQLite file, keyed by a fingerprint of the founder panel
+(genotypes, positions, IDs and groups) and a hash of each descendent's
+genotypes at those positions. A descendent whose genotypes and panel are both
+unchanged since it was last matched gets its stored match back.
+"""
+
+# basic utilities
+from typing import Iterator
+from contextlib import contextmanager
+import hashlib
+import json
+import sqlite3
+
+# bumped whenever matching changes in a way which could change results, so
+# matches stored before are not reused
+STORE_VERSION = 1
+# genotypes are hashed in a fixed layout, whatever integer type they were
+# stored in, so that no code is cut short and keys do not change with it
+HASH_TYPE = '<i8'
+
+def panel_key(founders, groups: dict[str, str]) -> str:
+    """
+    Fingerprint a founder panel, as used to match descendents
+
+    Parameters
+    ----------
+    founders : pd.DataFrame
+        k positions x n founders table of numeric genotypes, at the positions
+        shared with descendents
+    groups : dict[str, str]
+        Each founder ID pointing to its group's string, or None
+
+    Returns
+	-------
+	key : str
+        SHA-256 digest of everything about the panel which matches depend on
+    """
+
+    sha = hashlib.sha256()
+    sha.update(json.dumps({'version' : STORE_VERSION,
+                           'founders' : [str(id) for id in founders.columns],
+                           'groups' : groups}, sort_keys = True).encode())
+    sha.update(founders.index.values.astype('<i8').tobytes())
+    sha.update(_geno_bytes(founders.values))
+    return sha.hexdigest()
+
+def geno_keys(desc) -> list[str]:
+    """
+    Hash each descendent's genotypes
+
+    Parameters
+    ----------
+    desc : pd.DataFrame
+        k positions x n descendents table of numeric genotypes, at the same
+        positions as the founder panel
+
+    Returns
+	-------
+	keys : list[str]
+        SHA-256 digest of each descendent's genotypes, in column order
+    """
+
+    return [hashlib.sha256(_geno_bytes(row)).hexdigest() 
+            for row in desc.values.transpose()]
+
+def _geno_bytes(geno) -> bytes:
+    """
+    Lay out genotypes as bytes for hashing, without losing any code
+
+    Parameters
+    ----------
+    geno : np.ndarray
+        Numeric genotypes. Codes of long alleles may be Python integers too
+        big for any integer type, in an object array.
+
+    Returns
+	-------
+	layout : bytes
+        The genotypes as little-endian 64-bit integers, or as text (tagged so
+        it never equals such bytes) if they are too big
+    """
+
+    if geno.dtype != object:
+        return geno.astype(HASH_TYPE, order = 'C').tobytes()
+    return b'object:' + ','.join(str(code) for code in geno.ravel()).encode()
+
+def lookup(file: str, panel: str) -> dict[str, str]:
+    """
+    Load the matches stored for a founder panel
+
+    Parameters
+    ----------
+    file : str
+        SQLite store filename; created if it does not exist
+    panel : str
+        Founder panel fingerprint, from panel_key
+
+    Returns
+	-------
+	matches : dict[str, str]
+        Each stored genotype hash pointing to its match (None if it matched
+        no founder)
+    """
+
+    with _connect(file) as db:
+        return dict(db.execute('SELECT geno, match FROM matches '
+                               'WHERE panel = ?', (panel,)))
+
+def save(file: str, panel: str, matches: dict[str, str]) -> None:
+    """
+    Store matches for a founder panel, replacing any with the same keys
+
+    Parameters
+    ----------
+    file : str
+        SQLite store filename; created if it does not exist
+    panel : str
+        Founder panel fingerprint, from panel_key
+    matches : dict[str, str]
+        Each genotype hash, from geno_keys, pointing to its match (None if it
+        matched no founder)
+    """
+
+    with _connect(file) as db:
+        db.executemany('INSERT OR REPLACE INTO matches VALUES (?, ?, ?)',
+                       [(panel, geno, match)
+                        for geno, match in matches.items()])
+
+@contextmanager
+def _connect(file: str) -> Iterator[sqlite3.Connection]:
+    """
+    Open a store, making its table if needed, and commit changes once done
+
+    Parameters
+    ----------
+    file : str
+        SQLite store filename
+
+    Returns
+	-------
+	db : sqlite3.Connection
+        Connection to the store, closed once done
+    """
+
+    db = sqlite3.connect(file)
+    try:
+        db.execute('CREATE TABLE IF NOT EXISTS matches (panel TEXT NOT NULL, '
+                   'geno TEXT NOT NULL, match TEXT, PRIMARY KEY (panel, geno)) '
+                   'WITHOUT ROWID')
+        yield db
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,289 @@
+"""
+Region queries on bgzipped VCF files using their tabix (.tbi) or CSI index
+
+Reads the index directly, so that only the part of a VCF holding a requested
+region is decompressed, without needing the external tabix program.
+"""
+
+# basic utilities
+from typing import Iterator, Tuple
+import io
+import os
+import re
+import struct
+# BGZF blocks and index files are both deflate-compressed
+import gzip
+import zlib
+
+# magic numbers starting each (decompressed) index type
+TBI_MAGIC = b'TBI\x01'
+CSI_MAGIC = b'CSI\x01'
+# bin layout of tabix indexes; CSI files give their own
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+# a region is CHR, CHR:START or CHR:START-END (1-based, inclusive)
+REGION = re.compile(r'^(?P<chr>[^:]+)(:(?P<start>\d+)(-(?P<end>\d+))?)?$')
+# largest position an index can describe
+MAX_POS = 1 << 31
+
+def find_index(file: str) -> str:
+    """
+    Find the tabix or CSI index of a bgzipped file
+
+    Parameters
+    ----------
+    file : str
+        Filename of a bgzipped VCF
+
+    Returns
+	-------
+	index : str
+        Filename of the index, or None if there is none
+    """
+
+    for suffix in ['.tbi', '.csi']:
+        if os.path.exists(file + suffix): return file + suffix
+    return None
+
+def parse_region(region: str) -> Tuple[str, int, int]:
+    """
+    Split a region string into its parts
+
+    Parameters
+    ----------
+    region : str
+        CHR, CHR:START or CHR:START-END (1-based, inclusive)
+
+    Returns
+	-------
+	chr : str
+        Chromosome name
+    start : int
+        0-based start of the region (inclusive)
+    end : int
+        0-based end of the region (exclusive)
+    """
+
+    match = REGION.match(region)
+    if match is None: return None
+    start = 0 if match['start'] is None else max(int(match['start']) - 1, 0)
+    end = MAX_POS if match['end'] is None else int(match['end'])
+    return match['chr'], start, end
+
+def open_region(file: str, region: str) -> io.BufferedReader:
+    """
+    Open just the header and the blocks holding a region of a bgzipped VCF
+
+    Parameters
+    ----------
+    file : str
+        Filename of a bgzipped VCF
+    region : str
+        Region to read, as for parse_region
+
+    Returns
+	-------
+	stream : io.BufferedReader
+        Decompressed VCF text: the header, then lines at least covering the
+        region (callers must still filter by position). None if the file has
+        no usable index. If the chromosome is not in the index, only the header.
+    """
+
+    index = find_index(file)
+    parsed = None if region is None else parse_region(region)
+    if index is None or parsed is None: return None
+    chr, start, end = parsed
+    with open(index, 'rb') as f: 
+        parsed = _read_index(gzip.decompress(f.read()))
+    if parsed is None: return None
+    refs, layout = parsed
+
+    # the data is a single run from the first chunk's start to the last's end
+    bins = refs.get(chr, {})
+    chunks = [chunk for bin in _reg2bins(start, end, *layout)
+              for chunk in bins.get(bin, [])]
+    blocks = _read_header(file)
+    if chunks:
+        blocks = _chain(blocks, _read_blocks(file,
+                                             min(beg for beg, _ in chunks),
+                                             max(end for _, end in chunks)))
+    return io.BufferedReader(_IterRaw(blocks))
+
+class _IterRaw(io.RawIOBase):
+    """
+    Raw binary stream reading from an iterator of bytes objects
+    """
+
+    def __init__(self, blocks: Iterator[bytes]):
+        self._blocks = blocks
+        self._pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            self._pending = next(self._blocks, None)
+            if self._pending is None:
+                self._pending = b''
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+def _chain(*iterators: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Yield everything from each iterator in turn
+    """
+
+    for iterator in iterators: yield from iterator
+
+def _read_index(data: bytes) -> Tuple[dict, Tuple[int, int]]:
+    """
+    Parse a decompressed tabix or CSI index
+
+    Parameters
+    ----------
+    data : bytes
+        Decompressed index file contents
+
+    Returns
+	-------
+	refs : dict[str, dict[int, list[Tuple[int, int]]]]
+        For each chromosome, the (begin, end) virtual offsets of the chunks in
+        each bin
+    layout : Tuple[int, int]
+        The index's minimum shift and depth
+    """
+
+    def take(fmt: str):
+        nonlocal pos
+        values = struct.unpack_from('<' + fmt, data, pos)
+        pos += struct.calcsize('<' + fmt)
+        return values if len(values) > 1 else values[0]
+
+    pos = 4
+    if data[:4] == TBI_MAGIC:
+        min_shift, depth = TBI_MIN_SHIFT, TBI_DEPTH
+        n_ref = take('i')
+        names = _read_names(data, pos)
+        pos += 28 + struct.unpack_from('<i', data, pos + 24)[0]
+    elif data[:4] == CSI_MAGIC:
+        min_shift, depth, l_aux = take('3i')
+        # the names of a VCF's chromosomes are stored in tabix form in aux
+        if l_aux < 28: return None
+        names = _read_names(data, pos)
+        pos += l_aux
+        n_ref = take('i')
+    else: return None
+
+    # bins past the last real one hold metadata, not data locations
+    max_bin = ((1 << ((depth + 1) * 3)) - 1) // 7
+    refs = {}
+    for name in names[:n_ref]:
+        bins = {}
+        for _ in range(take('i')):
+            bin = take('I')
+            if data[:4] == CSI_MAGIC: take('Q')
+            chunks = [take('2Q') for _ in range(take('i'))]
+            if bin <= max_bin: bins[bin] = chunks
+        # tabix files also have a linear index, not needed here
+        if data[:4] == TBI_MAGIC: 
+            n_intv = take('i')
+            pos += 8 * n_intv
+        refs[name.decode()] = bins
+    return refs, (min_shift, depth)
+
+def _read_names(data: bytes, offset: int) -> list[bytes]:
+    """
+    Read chromosome names from a tabix-style header
+
+    Parameters
+    ----------
+    data : bytes
+        Decompressed index, holding a header of format, col_seq, col_beg,
+        col_end, meta, skip, l_nm and names
+    offset : int
+        Where the header's format field starts
+
+    Returns
+	-------
+	names : list[bytes]
+        Chromosome names in index order
+    """
+
+    l_nm = struct.unpack_from('<i', data, offset + 24)[0]
+    names = data[offset + 28:offset + 28 + l_nm]
+    return names.split(b'\0')[:-1]
+
+def _reg2bins(start: int, end: int, min_shift: int, depth: int) -> list[int]:
+    """
+    List the bins which may hold records overlapping a region
+
+    Parameters
+    ----------
+    start : int
+        0-based start of the region (inclusive)
+    end : int
+        0-based end of the region (exclusive)
+    min_shift : int
+        log2 of the smallest bin's width
+    depth : int
+        Levels of bins below the root
+
+    Returns
+	-------
+	bins : list[int]
+        Bin numbers, following the SAM/tabix specification
+    """
+
+    end = min(end, 1 << (min_shift + depth * 3)) - 1
+    bins, first, shift = [], 0, min_shift + depth * 3
+    for level in range(depth + 1):
+        bins.extend(range(first + (start >> shift), first + (end >> shift) + 1))
+        first += 1 << (level * 3)
+        shift -= 3
+    return bins
+
+def _read_header(file: str) -> Iterator[bytes]:
+    """
+    Yield the '#' header lines at the start of a bgzipped VCF
+
+    Parameters
+    ----------
+    file : str
+        Filename of a bgzipped VCF
+    """
+
+    with gzip.open(file, 'rb') as f:
+        for line in f:
+            if not line.startswith(b'#'): return
+            yield line
+
+def _read_blocks(file: str, begin: int, end: int) -> Iterator[bytes]:
+    """
+    Yield decompressed data between two BGZF virtual offsets
+
+    Parameters
+    ----------
+    file : str
+        Filename of a bgzipped file
+    begin : int
+        Virtual offset of the first byte to read
+    end : int
+        Virtual offset just past the last byte to read
+    """
+
+    offset, skip = begin >> 16, begin & 0xFFFF
+    with open(file, 'rb') as f:
+        f.seek(offset)
+        while offset <= end >> 16:
+            header = f.read(18)
+            if len(header) < 18: return
+            # BSIZE (block size minus one) sits in the BC extra subfield
+            size = struct.unpack_from('<H', header, 16)[0] + 1
+            block = zlib.decompress(f.read(size - 18)[:-8], -15)
+            if offset == end >> 16: block = block[:end & 0xFFFF]
+            yield block[skip:]
+            offset, skip = offset + size, 0
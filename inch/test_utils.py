@@ -1,7 +1,14 @@
-from . import myutils
+from . import myutils, tabix, serve, store
+import asyncio
+import json
 import pytest
+import numpy as np
 import pandas as pd
 from itertools import combinations, product
+import shutil
+import subprocess
+import sys
+import tracemalloc
 
 class TestUtilities:
     MULTI_FILE = 'test-files/multi_chr.vcf'
@@ -12,9 +19,11 @@ class TestUtilities:
                                    index = pd.Series([1, 2]))
 
     MULTI_CHR_GENO = {'Y' : pd.DataFrame([[0, -1]], columns = SAMPLE_NAMES,
-                                         index = pd.Series([1])),
+                                         index = pd.Series([1]), 
+                                         dtype = np.int8),
                       'MT' : pd.DataFrame([[57, 12]], columns = SAMPLE_NAMES,
-                                          index = pd.Series([2]))}
+                                          index = pd.Series([2]), 
+                                          dtype = np.int8)}
     
     IDS = ['F1', 'F2', 'F3']
     GENOS = pd.DataFrame([[1, 1, 1], [1, 1, 2], [1, 1, 2], [1, 2, 2]], 
@@ -22,6 +31,21 @@ class TestUtilities:
     MATRIX = pd.DataFrame([[0, 0.25, 0.75], [0.25, 0, 0.5], [0.75, 0.5, 0]],
                           index = IDS, columns = IDS)
     IDS = set(IDS)
+    # runs the command line in a fresh interpreter, then reports whether each
+    # heavy library is absent, imported lazily or actually loaded
+    STARTUP_SCRIPT = '''
+import importlib.util, json, sys
+from inch import inch
+args, heavy = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+sys.argv = ['inch'] + args
+try: inch.main()
+except SystemExit as e: code = e.code or 0
+else: code = 0
+states = {name : 'absent' if name not in sys.modules else 'lazy' 
+          if isinstance(sys.modules[name], importlib.util._LazyModule) 
+          else 'loaded' for name in heavy}
+print(json.dumps({'code' : code, 'states' : states}))
+'''
 
     def test_get_geno_single_chr(self):
         for file in self.SINGLE_CHR_FILES:
@@ -53,6 +77,54 @@ class TestUtilities:
             myutils._get_geno(self.MULTI_FILE, 'X')
         assert e_info.type == SystemExit
 
+    def test_startup(self):
+        # quick commands must leave the heavy libraries unloaded
+        heavy = ['numpy', 'pandas', 'allel', 'sklearn', 'scipy']
+        for args, code in [(['--version'], 0), (['--help'], 0), 
+                           (['-m', '-p', '2', 'x.vcf'], 1),
+                           (['-m', 'x.vcf'], 1)]:
+            run = subprocess.run([sys.executable, '-c', self.STARTUP_SCRIPT,
+                                  json.dumps(args), json.dumps(heavy)], 
+                                 capture_output = True, text = True)
+            result = json.loads(run.stdout.strip().split('\n')[-1])
+            assert result['code'] == code
+            assert set(result['states'].values()) <= {'absent', 'lazy'}
+            # the fast path must not have touched the lazy modules either
+            assert result['states']['numpy'] == 'lazy'
+
+    def test_compact_int(self):
+        assert myutils._compact_int(np.array([-1, 57])).dtype == np.int8
+        assert myutils._compact_int(np.array([0, 300])).dtype == np.int16
+        assert myutils._compact_int(np.array([5 ** 20])).dtype == np.int64
+        big = np.array([5 ** 30], dtype = object)
+        assert myutils._compact_int(big) is big
+
+    def test_shared_sites(self):
+        founder_pos = np.array([1, 3, 3, 5, 7])
+        desc_pos = np.array([3, 7, 2, 3, 3])
+        founder_rows, desc_rows = myutils._shared_sites(founder_pos, desc_pos)
+        # repeats pair up in order; the third 3 has no founder partner
+        assert list(founder_rows) == [1, 2, 4]
+        assert list(desc_rows) == [0, 3, 1]
+        assert (myutils._repeat_ranks(desc_pos) == [0, 0, 0, 1, 2]).all()
+
+    def test_parse_region(self):
+        assert tabix.parse_region('Y') == ('Y', 0, tabix.MAX_POS)
+        assert tabix.parse_region('MT:5') == ('MT', 4, tabix.MAX_POS)
+        assert tabix.parse_region('chrY:10-20') == ('chrY', 9, 20)
+        for region in ['Y:', 'Y:a-b', 'Y:1-', ':1-2']:
+            assert tabix.parse_region(region) is None
+    
+    def test_reg2bins(self):
+        # the root bin, then one bin per level for a small region
+        assert tabix._reg2bins(0, 1, 14, 5) == [0, 1, 9, 73, 585, 4681]
+        assert tabix._reg2bins(1 << 14, (1 << 14) + 1, 14, 5)[-1] == 4682
+        assert len(tabix._reg2bins(0, tabix.MAX_POS, 14, 5)) == 37449
+
+    def test_open_region_unindexed(self):
+        for file in self.SINGLE_CHR_FILES:
+            assert tabix.open_region(file, 'Y') is None
+    
     def test_error(self):
         for msg in ['ERROR', 'test message', '']:
             with pytest.raises(SystemExit) as e_info:
@@ -134,6 +206,38 @@ class TestUtilities:
         assert merged.shape == (1, 1)
         assert merged.loc['F1,F2,F3', 'F1,F2,F3'] == 0
     
+    def test_merge_unordered(self):
+        # groups out of matrix order, checked against averaging member pairs
+        rng = np.random.default_rng(0)
+        ids = ['F' + str(i) for i in range(7)]
+        dists = rng.random((7, 7))
+        matrix = pd.DataFrame(dists + dists.T, index = ids, columns = ids)
+        groups = [['F5', 'F0'], ['F3'], ['F6', 'F1', 'F4', 'F2']]
+        merged = myutils._merge_matrix_groups(matrix, groups)
+        for row, col in product(groups, groups):
+            expected = 0 if row == col else matrix.loc[row, col].values.mean()
+            assert merged.loc[','.join(row), ','.join(col)] == \
+                pytest.approx(expected)
+
+    def test_print_df_formats(self, tmp_path, monkeypatch):
+        # text is written a row at a time here, and must come out unchanged
+        monkeypatch.setattr(myutils, 'PRINT_ROWS', 1)
+        formats = ['tsv', 'tsv.gz', 'npz']
+        try:
+            import pyarrow
+            formats.append('parquet')
+        except ImportError: pass
+        for format in formats:
+            out = str(tmp_path / ('matrix' + myutils.OUT_FORMATS[format]))
+            assert myutils.output_format(out) == format
+            myutils.print_df(self.MATRIX, out)
+            matrix = myutils.read_matrix(out)
+            assert list(matrix.index) == list(self.MATRIX.index)
+            assert list(matrix.columns) == list(self.MATRIX.columns)
+            assert np.allclose(matrix, self.MATRIX)
+        with open(tmp_path / 'matrix.tsv') as f:
+            assert f.read() == self.MATRIX.to_csv(sep = '\t')
+
     def test_geno_dist_identical(self):
         dists = myutils._geno_dists(self.GENOS[['F1']], self.GENOS[['F1']])
         assert dists.shape == (1, 1)
@@ -153,8 +257,169 @@ class TestUtilities:
             for j in self.IDS:
                 assert dists.loc[i, j] == self.MATRIX.loc[i, j]
 
+    def test_geno_dist_engines_agree(self):
+        rng = np.random.default_rng(185)
+        genos = pd.DataFrame(rng.choice([0, 1, 2, 3, 4, -1, 57], 
+                                        size = (50, 7)))
+        for block in [1, 3, 64]:
+            mismatch, valid = myutils._hamming_counts(
+                genos.values[:, :4], genos.values[:, 4:], block)
+            assert (valid == ((genos.values[:, :4, None] != 0) & 
+                              (genos.values[:, None, 4:] != 0)).sum(0)).all()
+            assert (mismatch <= valid).all()
+        pairwise = myutils._geno_dists(genos, genos, 'pairwise')
+        for engine in ['bitpacked', 'blocked']:
+            dists = myutils._geno_dists(genos, genos, engine)
+            assert np.allclose(dists.values, pairwise.values, rtol = 0, 
+                               atol = 1e-12)
+    
+    def test_bitpacked_counts(self):
+        rng = np.random.default_rng(7)
+        # mostly biallelic positions, with some multiallelic and all-missing
+        genos = rng.choice([0, 1, 4], size = (300, 12))
+        genos[::7] = rng.choice([0, 2, 3, 4, -1], size = genos[::7].shape)
+        genos[5] = 0
+        for cut in [1, 6, 11]:
+            packed = myutils._bitpacked_counts(genos[:, :cut], genos[:, cut:])
+            blocked = myutils._hamming_counts(genos[:, :cut], genos[:, cut:])
+            for p, b in zip(packed, blocked):
+                assert (p == b).all()
+        huge = np.array([[5 ** 30, 1], [1, 0]], dtype = object)
+        mismatch, valid = myutils._bitpacked_counts(huge[:, :1], huge[:, 1:])
+        assert mismatch[0, 0] == 1 and valid[0, 0] == 1
+    
+    def test_masked_counts(self):
+        # masks applied inside the kernels agree with copying up front
+        rng = np.random.default_rng(8)
+        genos = rng.choice([0, 1, 4], size = (1500, 12)).astype(np.int8)
+        genos[::7] = rng.choice([0, 2, 3, 4, -1], size = genos[::7].shape)
+        sites = rng.random(1500) < 0.6
+        sites[1024:1100] = False
+        cols = np.array([5, 2, 3])
+        rows = genos[:, :4]
+        expected = myutils._hamming_counts(rows[sites], genos[sites][:, cols])
+        for counter in [myutils._hamming_counts, myutils._bitpacked_counts]:
+            for cells in [myutils.BLOCK_CELLS, 64]:
+                counts = counter(rows, genos, cells = cells, sites = sites, 
+                                 cols = cols)
+                assert all((a == b).all() for a, b in zip(counts, expected))
+    
+    def test_pack_bits_popcount(self):
+        bits = np.zeros((2, 70), dtype = bool)
+        bits[0, [0, 63, 64, 69]] = True
+        words = myutils._pack_bits(bits)
+        assert words.shape == (2, 2) and words.dtype == np.uint64
+        assert (myutils._popcount(words).sum(axis = 1) == [4, 0]).all()
+    
+    def test_geno_dist_threads(self):
+        rng = np.random.default_rng(6)
+        rows = pd.DataFrame(rng.choice([0, 1, 2, 3], size = (40, 9)))
+        cols = pd.DataFrame(rng.choice([0, 1, 2, 3], size = (40, 3)))
+        for engine in myutils.DIST_ENGINES:
+            serial = myutils._geno_dists(rows, cols, engine)
+            for threads in [2, 4, 9, 20]:
+                assert myutils._geno_dists(rows, cols, engine, threads) \
+                    .equals(serial)
+    
+    def test_bitpacked_memory(self):
+        # bit-packing must not cost more memory than the engine it speeds up
+        rng = np.random.default_rng(5)
+        rows, cols = [pd.DataFrame(rng.choice([0, 1, 4], size = (10000, n))
+                                   .astype(np.int8)) for n in [200, 50]]
+        for threads in [1, 4]:
+            peaks = {}
+            for engine in ['bitpacked', 'blocked']:
+                tracemalloc.start()
+                myutils._geno_dists(rows, cols, engine, threads)
+                peaks[engine] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            assert peaks['bitpacked'] <= peaks['blocked']
+    
+    def test_geno_dist_no_shared_calls(self):
+        dists = myutils._geno_dists(pd.DataFrame({'A': [0, 1]}),
+                                    pd.DataFrame({'B': [1, 0]}))
+        assert np.isnan(dists.loc['A', 'B'])
+    
+    def test_group_search(self):
+        # blocked search agrees with idxmin over the whole matrix, ties and all
+        rng = np.random.default_rng(1)
+        ids = ['F' + str(i) for i in range(9)]
+        dists = rng.integers(0, 4, (6, 9)) / 4
+        dists[0] = np.nan
+        dists[1, 3] = np.nan
+        matrix = pd.DataFrame(dists, columns = ids)
+        groups = {id : ['G1', 'G2', 'G3'][int(id[1]) % 3] for id in ids}
+        expected = matrix.iloc[1:].idxmin(axis = 1).replace(groups)
+        for size in [1, 2, 4, 9]:
+            blocks = [dists[:, i:i + size] for i in range(0, 9, size)]
+            matches = myutils._group_search(blocks, matrix.index, ids, groups)
+            assert pd.isna(matches[0])
+            assert (matches[1:] == expected).all()
+
+    def test_founder_blocks(self, monkeypatch):
+        # descendents packed once give the same distances as the whole matrix
+        rng = np.random.default_rng(3)
+        founders = pd.DataFrame(rng.choice([0, 1, 4], size = (200, 9)))
+        founders.iloc[::9] = rng.choice([0, 2, 3, 4],
+                                        size = founders.iloc[::9].shape)
+        desc = pd.DataFrame(rng.choice([0, 1, 2, 4], size = (200, 7)))
+        monkeypatch.setattr(myutils, 'FOUNDER_BLOCK', 4)
+        # distinct founders at informative positions only, then a shared
+        # position and a repeated founder
+        panels = [founders.copy()]
+        founders[8] = founders[2]
+        founders.iloc[3] = 4
+        panels.append(founders)
+        for founders, engine in product(panels, myutils.DIST_ENGINES):
+            full = myutils._geno_dists(desc, founders, engine).values
+            for threads in [1, 3]:
+                blocks = list(myutils._founder_blocks(desc, founders, engine,
+                                                      threads))
+                assert [block.shape[1] for block in blocks] == [4, 4, 1]
+                assert np.allclose(np.concatenate(blocks, axis = 1), full,
+                                   rtol = 0, atol = 1e-12, equal_nan = True)
+
+    def test_founder_panel(self):
+        geno = np.array([[1, 1, 1, 1], [1, 2, 1, 2], [3, 3, 0, 3], [2, 4, 2, 4]],
+                        dtype = np.int8)
+        informative, classes, inverse = myutils._founder_panel(geno)
+        assert list(informative) == [False, True, True, True]
+        # F1 and F3 differ only where F3 is missing
+        assert len(classes) == 3
+        assert inverse[1] == inverse[3] != inverse[0]
+        rows = np.array([[1, 0], [2, 2], [3, 4], [0, 4]], dtype = np.int8)
+        for engine in ['bitpacked', 'blocked']:
+            counts = myutils._row_parts_counts(rows, geno, 1, engine)
+            panel = myutils._panel_counts(rows, geno, 1, engine)
+            assert all((a == b).all() for a, b in zip(counts, panel))
+
+    def test_top_k(self):
+        # agrees with a full stable sort of each row, including ties and NaN
+        rng = np.random.default_rng(2)
+        valid = rng.integers(0, 3, (20, 7))
+        mismatch = np.minimum(rng.integers(0, 3, (20, 7)), valid)
+        dists = myutils._counts_to_dists(mismatch, valid)
+        order = np.argsort(np.where(np.isnan(dists), np.inf, dists), axis = 1,
+                           kind = 'stable')
+        for k in [1, 3, 7]:
+            best, top, sites, margin = myutils._top_k(mismatch, valid, k)
+            assert (best == order[:, :k]).all()
+            assert np.array_equal(top, np.take_along_axis(dists, best, 1), 
+                                  equal_nan = True)
+            assert (sites == np.take_along_axis(valid, best, 1)).all()
+            second = np.take_along_axis(dists, order[:, 1:2], 1)[:, 0]
+            assert np.array_equal(margin, second - top[:, 0], 
+                                  equal_nan = True)
+
+    def test_geno_dist_bad_engine(self):
+        with pytest.raises(SystemExit) as e_info:
+            myutils._geno_dists(self.GENOS, self.GENOS, 'fake')
+        assert e_info.type == SystemExit
+
 class TestAnalysis:
     FOUNDER_FILES = ['test-files/founders.vcf', 'test-files/founders.vcf.gz']
+    INDEXED_FOUNDER_FILES = ['test-files/founders.bgz.vcf.gz', 
+                             'test-files/founders.csi.vcf.gz']
     DESC_FILE = 'test-files/descendents.vcf'
     FAKE_FILE = 'test-files/fake.vcf'
     FOUNDER_GROUPS = [['F1,F2,F3,F4'], ['F1', 'F2', 'F4'], ['F1,F2', 'F3']]
@@ -262,6 +527,43 @@ class TestAnalysis:
                         assert any([id_f in ids[d] for id_f in f])
                     else: assert f in ids[d]
     
+    def test_identify_group_dists(self, tmp_path, monkeypatch):
+        out = str(tmp_path / 'groups.tsv')
+        monkeypatch.setattr(myutils, 'FOUNDER_BLOCK', 1)
+        ids = myutils.identify_founders(self.FOUNDER_FILES[0], self.DESC_FILE,
+                                        'Y', ['F1,F3', 'F2'], None, 
+                                        group_dists = out)
+        myutils.identify_founders(self.FOUNDER_FILES[0], self.DESC_FILE, 'Y',
+                                  None, str(tmp_path / 'matrix.tsv'))
+        matrix = pd.read_csv(tmp_path / 'matrix.tsv', sep = '\t', 
+                             index_col = 0)
+        group_dists = pd.read_csv(out, sep = '\t', index_col = 0)
+        assert list(group_dists.columns) == ['F1,F3', 'F2', 'F4']
+        assert np.allclose(group_dists['F1,F3'], 
+                           matrix[['F1', 'F3']].min(axis = 1), atol = 1e-4)
+        assert (group_dists.idxmin(axis = 1) == ids).all()
+        with pytest.raises(SystemExit):
+            myutils.identify_founders(self.FOUNDER_FILES[0], self.DESC_FILE,
+                                      'Y', None, None, group_dists = out)
+
+    def test_nearest_founders(self):
+        ids = myutils.identify_founders(self.FOUNDER_FILES[0], self.DESC_FILE, 
+                                        'Y', None, None)
+        for chunk_size in [None, 2]:
+            nearest = myutils.nearest_founders(
+                self.FOUNDER_FILES[0], self.DESC_FILE, 'Y', 2, 
+                chunk_size = chunk_size)
+            assert list(nearest.columns) == [
+                'founder_1', 'distance_1', 'sites_1', 
+                'founder_2', 'distance_2', 'sites_2', 'margin']
+            assert (nearest['founder_1'] == ids).all()
+            assert np.allclose(nearest['margin'], 
+                               nearest['distance_2'] - nearest['distance_1'])
+        for k in [0, 5]:
+            with pytest.raises(SystemExit):
+                myutils.nearest_founders(self.FOUNDER_FILES[0], self.DESC_FILE,
+                                         'Y', k)
+
     def test_identify_diff_bad_groups(self):
         for f_file in self.FOUNDER_FILES:
             for groups in self.FOUNDER_BAD_GROUPS:
@@ -280,6 +582,362 @@ class TestAnalysis:
                                                   chr, groups, None)
                     assert e_info.type == SystemExit
     
+    def test_identify_streaming(self):
+        for f_file, chr in product(self.FOUNDER_FILES, ['Y', 'MT']):
+            founders, founder_chr = myutils._get_geno(f_file, chr)
+            for d_file in [f_file, self.DESC_FILE]:
+                if d_file == self.DESC_FILE and chr == 'MT': continue
+                desc = myutils._get_geno(d_file, chr)[0]
+                shared = founders.index.intersection(desc.index)
+                full = myutils._geno_dists(desc.loc[shared], 
+                                           founders.loc[shared])
+                for chunk_size in [1, 2, 1000]:
+                    streamed = myutils._stream_dists(founders, founder_chr, 
+                                                     d_file, chr, chunk_size)
+                    assert streamed.equals(full)
+                    ids = myutils.identify_founders(f_file, d_file, chr, None, 
+                                                    None, chunk_size = 2,
+                                                    threads = 3)
+                    assert ids.equals(full.idxmin(axis = 1))
+    
+    def test_identify_streaming_errors(self):
+        for f_file in self.FOUNDER_FILES:
+            for d_file, chr in [(self.DESC_FILE, 'MT'), (self.DESC_FILE, 'X'),
+                                (self.FAKE_FILE, 'Y'), (f_file, None)]:
+                with pytest.raises(SystemExit) as e_info:
+                    myutils.identify_founders(f_file, d_file, chr, None, None,
+                                              chunk_size = 1)
+                assert e_info.type == SystemExit
+
+    def test_index_used(self, tmp_path):
+        for f_file in self.FOUNDER_FILES:
+            vcf = str(tmp_path / f_file.split('/')[-1])
+            shutil.copy(f_file, vcf)
+            for chr in ['Y', 'MT']:
+                parsed = myutils._parse_geno(vcf, chr)
+                assert myutils._load_index(vcf, chr) is None
+                index = myutils.index_vcf(vcf, chr)
+                assert index.endswith(myutils.INDEX_SUFFIX)
+                indexed = myutils._load_index(vcf, chr)
+                assert indexed[0].equals(parsed[0]) and indexed[1] == chr
+                # genotypes are read-only memory maps, not in-memory copies
+                assert not indexed[0].values.flags.writeable
+                assert myutils.identify_founders(vcf, vcf, chr, None, None) \
+                    .equals(myutils.identify_founders(f_file, f_file, chr, 
+                                                      None, None))
+                assert myutils.dist_matrix(vcf, chr, None).equals(
+                    myutils.dist_matrix(f_file, chr, None))
+            # the Y index must not be mistaken for the whole file
+            assert myutils._load_index(vcf, None) is None
+    
+    def test_index_stale(self, tmp_path):
+        vcf = str(tmp_path / 'desc.vcf')
+        shutil.copy(self.DESC_FILE, vcf)
+        myutils.index_vcf(vcf, None)
+        # a whole-file index also serves its single chromosome
+        for chr in [None, 'Y']:
+            assert myutils._load_index(vcf, chr) is not None
+        with open(vcf, 'a') as f: f.write('\n')
+        assert myutils._load_index(vcf, None) is None
+
+    def test_indexed_regions(self):
+        for file in self.INDEXED_FOUNDER_FILES:
+            for region, pos in [('Y', [1, 2, 3, 4, 5, 6, 7, 10]), 
+                                ('MT', [1, 2, 4]), ('Y:3-5', [3, 4, 5]),
+                                ('MT:2-3', [2]), ('Y:8-9', [])]:
+                stream = tabix.open_region(file, region)
+                assert stream is not None
+                text = stream.read().decode()
+                assert text.startswith('##fileformat')
+                if not pos:
+                    with pytest.raises(SystemExit) as e_info:
+                        myutils._get_geno(file, region)
+                    assert e_info.type == SystemExit
+                    continue
+                geno, chr = myutils._get_geno(file, region)
+                assert list(geno.index) == pos
+                assert chr == region.split(':')[0]
+                assert geno.equals(myutils._get_geno(self.FOUNDER_FILES[0], 
+                                                     region)[0])
+            for region in ['X', 'X:1-10']:
+                with pytest.raises(SystemExit) as e_info:
+                    myutils._get_geno(file, region)
+                assert e_info.type == SystemExit
+    
+    def test_identify_indexed(self):
+        for f_file in self.INDEXED_FOUNDER_FILES:
+            for chr in ['Y', 'MT', 'Y:2-6']:
+                for chunk_size in [None, 2]:
+                    ids = myutils.identify_founders(f_file, f_file, chr, None, 
+                                                    None, 
+                                                    chunk_size = chunk_size)
+                    assert ids.equals(myutils.identify_founders(
+                        self.FOUNDER_FILES[0], self.FOUNDER_FILES[0], chr, 
+                        None, None))
+
+    def test_many_alts(self, tmp_path):
+        # more ALT alleles than scikit-allel parses by default, mid-file
+        vcf = str(tmp_path / 'alts.vcf')
+        with open('test-files/single_chr.vcf') as f: 
+            header = f.read().rstrip('\n') + '\n'
+        with open(vcf, 'w') as f:
+            f.write(header)
+            f.write('Y\t3\t.\tA\tC,G,T,AA,AC\t20\tPASS\t.\tGT\t5\t3\n')
+            f.write('Y\t4\t.\tA\tC\t20\tPASS\t.\tGT\t.\t1\n')
+        expected = [[1, 4], [2, 3], [7, 4], [0, 2]]
+        geno = myutils._parse_geno(vcf, None)[0]
+        assert (geno.values == expected).all()
+        assert list(geno.index) == [1, 2, 3, 4]
+        for chunk_size in [1, 2, 3]:
+            chunks = list(myutils._iter_vcf(vcf, None, chunk_size)[1])
+            decoded = np.concatenate([myutils._decode_geno(chunk) 
+                                      for chunk in chunks])
+            assert (decoded == expected).all()
+
+    def test_identify_repeated_pos(self, tmp_path):
+        # a split multiallelic site: each copy must meet its own counterpart
+        vcfs = {}
+        with open('test-files/single_chr.vcf') as f: 
+            header = f.read().rstrip('\n').split('\n')
+        header = '\n'.join(line for line in header if line.startswith('#'))
+        for name, rows in [('founders', ['A\tC\tGT\t0\t1', 
+                                         'A\tG\tGT\t1\t0']),
+                           ('desc', ['A\tC\tGT\t1\t0', 
+                                     'A\tG\tGT\t0\t1'])]:
+            vcfs[name] = str(tmp_path / (name + '.vcf'))
+            with open(vcfs[name], 'w') as f:
+                f.write(header + '\n')
+                for row in rows: 
+                    f.write('Y\t5\t.\t' + row.replace('GT', 
+                            '20\tPASS\t.\tGT') + '\n')
+        for chunk_size in [None, 1]:
+            best = myutils.identify_founders(vcfs['founders'], vcfs['desc'], 
+                                             None, None, None, 
+                                             chunk_size = chunk_size)
+            assert list(best) == ['S2', 'S1']
+
+    def test_identify_stored(self, tmp_path, capsys):
+        store = str(tmp_path / 'matches.db')
+        # a new copy of D4, and a changed call for D1
+        changed = str(tmp_path / 'changed.vcf')
+        with open(self.DESC_FILE) as f: 
+            lines = f.read().rstrip('\n').split('\n')
+        with open(changed, 'w') as f:
+            for line in lines:
+                if not line.startswith('##'):
+                    line += '\t' + line.split('\t')[-1].replace('D4', 'D5')
+                if line.startswith('Y\t7\t'): 
+                    line = line.replace('GT\t1', 'GT\t0')
+                f.write(line + '\n')
+        for groups in [None, ['F1,F2']]:
+            for file, unchanged in [(self.DESC_FILE, 0), (self.DESC_FILE, 4), 
+                                    (changed, 4)]:
+                capsys.readouterr()
+                matches = myutils.identify_founders(self.FOUNDER_FILES[0], file,
+                                                    'Y', groups, None, 
+                                                    result_store = store)
+                assert '{n} descendents unchanged'.format(n = unchanged) in \
+                    capsys.readouterr().err
+                assert matches.equals(myutils.identify_founders(
+                    self.FOUNDER_FILES[0], file, 'Y', groups, None))
+        with pytest.raises(SystemExit):
+            myutils.identify_founders(self.FOUNDER_FILES[0], self.DESC_FILE, 
+                                      'Y', None, None, chunk_size = 2,
+                                      result_store = store)
+
+    def test_samples(self, tmp_path):
+        founder_ids, desc_ids = ['F4', 'F1', 'F3'], ['D3', 'D1']
+        founders = myutils._get_geno(self.FOUNDER_FILES[0], 'Y')[0]
+        founders, desc = myutils._shared_geno(founders, 'Y', self.DESC_FILE, 
+                                              'Y')
+        expected = myutils._geno_dists(desc[['D1', 'D3']], 
+                                       founders[['F1', 'F3', 'F4']])
+        for chunk_size in [None, 2]:
+            matches = myutils.identify_founders(
+                self.FOUNDER_FILES[0], self.DESC_FILE, 'Y', None, None,
+                chunk_size = chunk_size, founder_samples = founder_ids, 
+                samples = desc_ids)
+            assert matches.equals(expected.idxmin(axis = 1))
+
+        # parsed, indexed and cached genotypes are all cut down the same way
+        vcf = str(tmp_path / 'founders.vcf')
+        shutil.copy(self.FOUNDER_FILES[0], vcf)
+        parsed = myutils._get_geno(vcf, 'Y', founder_ids)[0]
+        assert list(parsed.columns) == ['F1', 'F3', 'F4']
+        myutils.index_vcf(vcf, 'Y')
+        indexed = myutils._load_index(vcf, 'Y', founder_ids)[0]
+        with myutils.read_chroms([vcf, vcf], None, [['F1'], founder_ids]):
+            cached = myutils._get_geno(vcf, 'Y', founder_ids)[0]
+        for geno in [indexed, cached]:
+            assert list(geno.columns) == list(parsed.columns)
+            assert (geno.values == parsed.values).all()
+        for file in [vcf, self.FOUNDER_FILES[1]]:
+            with pytest.raises(SystemExit):
+                myutils._get_geno(file, 'Y', ['F1', 'X'])
+
+    def test_identify_stored_long_alleles(self, tmp_path):
+        # codes of long alleles are too big for small integers; none may be
+        # cut short into another genotype's key
+        wide = pd.DataFrame(np.array([[1], [1 + (1 << 32)]], 
+                                     dtype = np.int64).T)
+        huge = pd.DataFrame(np.array([[5 ** 30], [5 ** 30 + (1 << 64)]], 
+                                     dtype = object).T)
+        for geno in [wide, huge]:
+            assert len(set(store.geno_keys(geno))) == 2
+        assert store.panel_key(wide, None) != store.panel_key(wide.iloc[:, ::-1], 
+                                                              None)
+
+        vcfs = {}
+        with open('test-files/single_chr.vcf') as f: 
+            header = f.read().rstrip('\n').split('\n')
+        header = '\n'.join(line for line in header if line.startswith('#'))
+        for name, calls in [('founders', '0\t1'), ('desc', '1\t0')]:
+            vcfs[name] = str(tmp_path / (name + '.vcf'))
+            with open(vcfs[name], 'w') as f:
+                f.write(header + '\n')
+                for pos, alt in [(1, 'A' * 32), (2, 'ACGT' * 4)]:
+                    f.write('Y\t{pos}\t.\tC\t{alt}\t20\tPASS\t.\tGT\t{calls}\n'
+                            .format(pos = pos, alt = alt, calls = calls))
+        expected = myutils.identify_founders(vcfs['founders'], vcfs['desc'], 
+                                             None, None, None)
+        for _ in range(2):
+            assert expected.equals(myutils.identify_founders(
+                vcfs['founders'], vcfs['desc'], None, None, None,
+                result_store = str(tmp_path / 'matches.db')))
+
+    def test_identify_batch(self):
+        files = [self.DESC_FILE] + self.FOUNDER_FILES
+        for groups, jobs in product([None, ['F1,F2']], [1, 2]):
+            results = list(myutils.identify_batch(self.FOUNDER_FILES[0], files,
+                                                  'Y', groups, jobs))
+            assert [file for file, _ in results] == files
+            for file, matches in results:
+                assert matches.equals(myutils.identify_founders(
+                    self.FOUNDER_FILES[0], file, 'Y', groups, None))
+
+    def test_serve(self, tmp_path):
+        socket = str(tmp_path / 'inch.sock')
+        expected = myutils.identify_founders(self.FOUNDER_FILES[0], 
+                                             self.DESC_FILE, 'Y', None, None)
+        with open(self.DESC_FILE) as f: text = f.read()
+        requests = [{'id': 1, 'vcf': self.DESC_FILE}, {'text': text}, 
+                    {'vcf': self.FAKE_FILE}, {'vcf': 'x', 'text': 'x'}, [],
+                    {'text': 123}, {'vcf': 'test-files'}, 
+                    {'id': 2, 'vcf': self.DESC_FILE}]
+
+        async def query():
+            with myutils.founder_pool(self.FOUNDER_FILES[0], 'Y', None) as pool:
+                server = await serve.start(pool, socket)
+                reader, writer = await asyncio.open_unix_connection(socket)
+                responses = []
+                for request in requests:
+                    writer.write(json.dumps(request).encode() + b'\n')
+                    responses.append(json.loads(await reader.readline()))
+                writer.close()
+                server.close()
+                await server.wait_closed()
+            return responses
+
+        responses = asyncio.run(query())
+        assert responses[0] == {'id': 1, 'matches': expected.to_dict()}
+        assert responses[1] == {'matches': expected.to_dict()}
+        for response in responses[2:-1]:
+            assert list(response) == ['error']
+        assert 'Unable to read VCF file' in responses[2]['error']
+        # bad requests are answered without dropping the connection
+        assert responses[-1] == {'id': 2, 'matches': expected.to_dict()}
+
+    def test_read_chroms(self):
+        for f, d in product(self.FOUNDER_FILES, repeat = 2):
+            with myutils.read_chroms([f, d], None) as chrs:
+                assert chrs == ['Y', 'MT']
+                together = {chr : myutils.identify_founders(f, d, chr, None, 
+                                                            None)
+                            for chr in chrs}
+                with pytest.raises(SystemExit):
+                    myutils.identify_founders(f, d, 'X', None, None)
+            assert not myutils._CHROM_GENO
+            for chr, matches in together.items():
+                assert matches.equals(myutils.identify_founders(f, d, chr, 
+                                                                None, None))
+        with myutils.read_chroms([self.FOUNDER_FILES[0]], ['MT']) as chrs:
+            assert chrs == ['MT']
+            assert list(myutils._CHROM_GENO[self.FOUNDER_FILES[0]]) == ['MT']
+
+    def test_read_chroms_subset(self, monkeypatch):
+        # only chromosomes asked for are decoded, and tabix-indexed VCFs are
+        # read a chromosome at a time
+        reads, decoded = [], []
+        read_vcf, decode_geno = myutils._read_vcf, myutils._decode_geno
+        monkeypatch.setattr(myutils, '_read_vcf', lambda file, chr, *rest: 
+                            reads.append(chr) or read_vcf(file, chr, *rest))
+        monkeypatch.setattr(myutils, '_decode_geno', lambda vcf: 
+                            decoded.extend(vcf['variants/CHROM']) or 
+                            decode_geno(vcf))
+        expected = myutils._parse_geno(self.FOUNDER_FILES[0], 'MT')[0]
+        for file in [self.FOUNDER_FILES[0]] + self.INDEXED_FOUNDER_FILES:
+            reads.clear(), decoded.clear()
+            with myutils.read_chroms([file], ['MT']):
+                assert myutils._get_geno(file, 'MT')[0].equals(expected)
+            assert set(decoded) == {'MT'}
+            assert reads == ([None] if file == self.FOUNDER_FILES[0] 
+                             else ['MT'])
+    
+    def test_profile(self, tmp_path):
+        file = str(tmp_path / 'profile.json')
+        with myutils.profile(file) as record:
+            matches = myutils.identify_founders(self.FOUNDER_FILES[0], 
+                                                self.DESC_FILE, 'Y', None, 
+                                                None)
+            # nothing is recorded from other threads
+            with myutils.ThreadPoolExecutor(1) as pool:
+                pool.submit(myutils._get_geno, self.DESC_FILE, 'Y').result()
+        assert matches.equals(myutils.identify_founders(
+            self.FOUNDER_FILES[0], self.DESC_FILE, 'Y', None, None))
+        with open(file) as f: assert json.load(f) == record
+        stages = record['stages']
+        assert list(stages) == ['get_geno', 'get_geno/read_vcf', 
+                                'get_geno/decode_geno', 'shared_sites', 
+                                'geno_dists']
+        assert stages['get_geno']['calls'] == 2
+        assert stages['geno_dists']['arrays']['matrix']['shape'] == [4, 4]
+        for stage in list(stages.values()) + [record['total']]:
+            assert stage['wall_seconds'] >= 0 and stage['cpu_seconds'] >= 0
+            assert stage['peak_rss_mb'] > 0
+        # without a profile, stages record nothing
+        assert myutils._PROFILE is None
+        with myutils.profile() as record: 
+            myutils._get_geno(self.DESC_FILE, 'Y')
+        assert record is None
+
+    def test_cli_chr(self, tmp_path):
+        # -c takes one chromosome, so the founders VCF may follow it
+        run = subprocess.run([sys.executable, '-m', 'inch.inch', '-d', 
+                              self.DESC_FILE, '-c', 'Y', 
+                              self.FOUNDER_FILES[0]], capture_output = True,
+                             text = True)
+        assert run.returncode == 0
+        expected = myutils.identify_founders(self.FOUNDER_FILES[0], 
+                                             self.DESC_FILE, 'Y', None, None)
+        assert run.stdout == ''.join('{id}\t{match}\n'.format(id = id, 
+                                                               match = match)
+                                     for id, match in expected.items())
+        # and is repeated for several chromosomes
+        combined = str(tmp_path / 'combined.tsv')
+        run = subprocess.run([sys.executable, '-m', 'inch.inch', '-d', 
+                              self.FOUNDER_FILES[0], '-c', 'Y', '-c', 'MT', 
+                              '--combined', combined, self.FOUNDER_FILES[0]],
+                             capture_output = True, text = True)
+        assert run.returncode == 0
+        assert list(pd.read_csv(combined, sep = '\t', index_col = 0)) == \
+            ['Y', 'MT']
+
+    def test_chrom_path(self):
+        assert myutils.chrom_path(None, 'Y') is None
+        assert myutils.chrom_path('out', 'Y') == 'out.Y'
+        assert myutils.chrom_path('a/out.tsv', 'MT') == 'a/out.MT.tsv'
+        assert myutils.chrom_path('out.tsv.gz', 'Y') == 'out.Y.tsv.gz'
+
     def test_pca_fake_vcf(self):
         with pytest.raises(SystemExit) as e_info:
             myutils.pca(self.FAKE_FILE, None, 2)
@@ -299,6 +957,22 @@ class TestAnalysis:
                     assert d3_d4 <= abs(evectors.loc[i, 'PC1'] - 
                                         evectors.loc[j, 'PC1'])
     
+    def test_pca_solvers(self):
+        expected, expected_values = myutils.pca(self.DESC_FILE, 'Y', 3, 'full')
+        for solver, chunk_size in [('randomized', None), ('incremental', None),
+                                   ('incremental', 1), ('incremental', 3)]:
+            evectors, evalues = myutils.pca(self.DESC_FILE, 'Y', 3, solver, 
+                                            chunk_size)
+            assert np.allclose(evalues, expected_values, rtol = 1e-4)
+            # each PC may come out flipped
+            for pc in evectors.columns:
+                assert np.allclose(abs(evectors[pc]), abs(expected[pc]), 
+                                   rtol = 1e-3, atol = 1e-3)
+        with pytest.raises(SystemExit):
+            myutils.pca(self.DESC_FILE, 'Y', 5, 'incremental')
+        with pytest.raises(SystemExit):
+            myutils.pca(self.DESC_FILE, 'Y', 2, 'fake')
+
     def test_pca_wrong_single_chr(self):
         for n in range(1, 5):
             with pytest.raises(SystemExit) as e_info:
@@ -333,6 +1007,24 @@ class TestAnalysis:
                         assert f3_f4 <= abs(evectors.loc[i, 'PC1'] - 
                                             evectors.loc[j, 'PC1'])
     
+    def test_pca_project(self):
+        file = self.FOUNDER_FILES[0]
+        evectors, evalues = myutils.pca(file, 'Y', 2)
+        for chunk_size in [1, 3, None]:
+            # founders placed on their own PCs land where they already are
+            both, both_values = myutils.pca(file, 'Y', 2, project = file, 
+                                            chunk_size = chunk_size)
+            assert both.shape == (8, 2)
+            assert (both_values == evalues).all()
+            assert np.allclose(both.iloc[:4], evectors)
+            assert np.allclose(both.iloc[4:], evectors, atol = 1e-4)
+        projected = myutils.pca(file, 'Y', 2, project = self.DESC_FILE)[0]
+        assert list(projected.index) == self.FOUNDER_IDS + self.DESC_IDS
+        with pytest.raises(SystemExit):
+            myutils.pca(file, 'Y', 2, 'incremental', project = self.DESC_FILE)
+        with pytest.raises(SystemExit):
+            myutils.pca(file, 'MT', 2, project = 'test-files/single_chr.vcf')
+
     def test_pca_nonexist_multi_chr(self):
         for file in self.FOUNDER_FILES:
             for n in range(1, 4):
@@ -25,7 +25,7 @@ setup(
     description='CSE185 Class Project',
     author='Faith Okamoto',
     author_email='fokamoto@ucsd.edu',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     entry_points={
         "console_scripts": [
             "inch=inch.inch:main"